@@ -4,9 +4,11 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from functools import wraps
+from datetime import datetime
+from sqlalchemy.orm import load_only
 from app.models import (
-    db, Faculty, Department, Module,
-    LecturerAssignment, Lecturer
+    db, Faculty, Department, Course, Module,
+    LecturerAssignment, Lecturer, User
 )
 
 # -------------------------------
@@ -32,6 +34,19 @@ def admin_required(func):
     return decorated_function
 
 
+# -------------------------------
+# Helper: Admin Dashboard Data
+# -------------------------------
+def load_dashboard():
+    """
+    What admin_dashboard.html renders on the server: the faculty filter and
+    dropdown options. Lecturers and assignments are fetched a page at a
+    time from the listing APIs below.
+    """
+    faculties = Faculty.query.options(load_only(Faculty.name)).order_by(Faculty.name).all()
+    return {"faculties": faculties}
+
+
 # -------------------------------
 # Admin Dashboard
 # -------------------------------
@@ -39,26 +54,183 @@ def admin_required(func):
 @login_required
 @admin_required
 def dashboard():
-    """Render admin dashboard with lecturers and assignments."""
+    """Render admin dashboard; the tables load through the listing APIs."""
     try:
-        lecturers = Lecturer.query.join(Lecturer.user).all()
-        faculties = Faculty.query.all()
-        departments = Department.query.all()
-        modules = Module.query.all()
-        assignments = LecturerAssignment.query.order_by(LecturerAssignment.assigned_at.desc()).all()
+        data = load_dashboard()
     except Exception as e:
         flash(f"Error loading dashboard: {str(e)}", "danger")
-        lecturers, faculties, departments, modules, assignments = [], [], [], [], []
-
-    return render_template(
-        "admin_dashboard.html",
-        admin=current_user,
-        lecturers=lecturers,
-        faculties=faculties,
-        departments=departments,
-        modules=modules,
-        assignments=assignments
+        data = {"faculties": []}
+
+    return render_template("admin_dashboard.html", admin=current_user, **data)
+
+
+# -------------------------------
+# Helper: Listing Pages
+# -------------------------------
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return f"{value}_{row_id}"
+
+def decode_cursor(cursor):
+    """"<sort value>_<id>" -> (value, id); raises ValueError."""
+    value, _, row_id = cursor.rpartition("_")
+    return value, int(row_id)
+
+def listing_args():
+    """Common ?limit, ?faculty_id, ?department_id and ?q arguments; raises ValueError."""
+    args = request.args
+    return {
+        "limit": min(max(int(args.get("limit", 50)), 1), 200),
+        "faculty_id": int(args["faculty_id"]) if args.get("faculty_id") else None,
+        "department_id": int(args["department_id"]) if args.get("department_id") else None,
+        "q": args.get("q", "").strip(),
+    }
+
+
+# -------------------------------
+# Lecturer Listing (JSON)
+# -------------------------------
+@admin_bp.route("/admin/api/lecturers")
+@login_required
+@admin_required
+def api_lecturers():
+    """
+    One page of lecturers ordered by name, with their assignments.
+
+      ?q=text            name, email or employee id contains text
+      ?faculty_id=, ?department_id=
+      ?after=<cursor>    the page after this cursor ("next" of the last page)
+      ?limit=N           page size (default 50, at most 200)
+
+    Two column-only queries per page, however many lecturers exist.
+    """
+    try:
+        args = listing_args()
+        after = decode_cursor(request.args["after"]) if request.args.get("after") else None
+    except ValueError:
+        return jsonify({"msg": "Invalid filter, cursor or limit"}), 400
+
+    query = (
+        db.session.query(
+            Lecturer.id, Lecturer.employee_id, User.full_name, User.email,
+            Department.name.label("department"), Faculty.name.label("faculty"),
+        )
+        .join(User, User.id == Lecturer.id)
+        .outerjoin(Department, Department.id == Lecturer.department_id)
+        .outerjoin(Faculty, Faculty.id == Department.faculty_id)
+    )
+    if args["faculty_id"]:
+        query = query.filter(Lecturer.faculty_id == args["faculty_id"])
+    if args["department_id"]:
+        query = query.filter(Lecturer.department_id == args["department_id"])
+    if args["q"]:
+        query = query.filter(db.or_(
+            User.full_name.icontains(args["q"], autoescape=True),
+            User.email.icontains(args["q"], autoescape=True),
+            Lecturer.employee_id.icontains(args["q"], autoescape=True),
+        ))
+    if after:
+        query = query.filter(db.tuple_(User.full_name, Lecturer.id) > after)
+
+    # One extra row tells us whether another page exists
+    rows = query.order_by(User.full_name, Lecturer.id).limit(args["limit"] + 1).all()
+    has_more = len(rows) > args["limit"]
+    rows = rows[:args["limit"]]
+
+    assigned = {}
+    if rows:
+        for a in (
+            db.session.query(LecturerAssignment.id, LecturerAssignment.lecturer_id, Module.name)
+            .join(Module, Module.id == LecturerAssignment.module_id)
+            .filter(LecturerAssignment.lecturer_id.in_([r.id for r in rows]))
+            .order_by(LecturerAssignment.assigned_at.desc())
+        ):
+            assigned.setdefault(a.lecturer_id, []).append({"id": a.id, "module": a.name})
+
+    return jsonify({
+        "lecturers": [{
+            "id": r.id,
+            "employee_id": r.employee_id,
+            "full_name": r.full_name,
+            "email": r.email,
+            "faculty": r.faculty,
+            "department": r.department,
+            "assignments": assigned.get(r.id, []),
+        } for r in rows],
+        "next": encode_cursor(rows[-1].full_name, rows[-1].id) if has_more else None,
+    })
+
+
+# -------------------------------
+# Assignment Listing (JSON)
+# -------------------------------
+@admin_bp.route("/admin/api/assignments")
+@login_required
+@admin_required
+def api_assignments():
+    """
+    One page of lecturer assignments, newest first.
+
+      ?q=text            module or lecturer name contains text
+      ?faculty_id=, ?department_id=, ?lecturer_id=
+      ?after=<cursor>, ?limit=N   as for /admin/api/lecturers
+    """
+    try:
+        args = listing_args()
+        lecturer_id = int(request.args["lecturer_id"]) if request.args.get("lecturer_id") else None
+        after = None
+        if request.args.get("after"):
+            assigned_at, row_id = decode_cursor(request.args["after"])
+            after = (datetime.fromisoformat(assigned_at), row_id)
+    except ValueError:
+        return jsonify({"msg": "Invalid filter, cursor or limit"}), 400
+
+    query = (
+        db.session.query(
+            LecturerAssignment.id, LecturerAssignment.assigned_at, LecturerAssignment.lecturer_id,
+            User.full_name, Module.name.label("module"),
+            Faculty.name.label("faculty"), Department.name.label("department"),
+        )
+        .join(User, User.id == LecturerAssignment.lecturer_id)
+        .join(Module, Module.id == LecturerAssignment.module_id)
+        .join(Faculty, Faculty.id == LecturerAssignment.faculty_id)
+        .join(Department, Department.id == LecturerAssignment.department_id)
     )
+    if args["faculty_id"]:
+        query = query.filter(LecturerAssignment.faculty_id == args["faculty_id"])
+    if args["department_id"]:
+        query = query.filter(LecturerAssignment.department_id == args["department_id"])
+    if lecturer_id:
+        query = query.filter(LecturerAssignment.lecturer_id == lecturer_id)
+    if args["q"]:
+        query = query.filter(db.or_(
+            Module.name.icontains(args["q"], autoescape=True),
+            User.full_name.icontains(args["q"], autoescape=True),
+        ))
+    if after:
+        query = query.filter(db.tuple_(LecturerAssignment.assigned_at, LecturerAssignment.id) < after)
+
+    rows = (
+        query.order_by(LecturerAssignment.assigned_at.desc(), LecturerAssignment.id.desc())
+        .limit(args["limit"] + 1)
+        .all()
+    )
+    has_more = len(rows) > args["limit"]
+    rows = rows[:args["limit"]]
+
+    return jsonify({
+        "assignments": [{
+            "id": r.id,
+            "lecturer_id": r.lecturer_id,
+            "lecturer": r.full_name,
+            "module": r.module,
+            "faculty": r.faculty,
+            "department": r.department,
+            "assigned_at": r.assigned_at.isoformat() if r.assigned_at else None,
+        } for r in rows],
+        "next": encode_cursor(rows[-1].assigned_at, rows[-1].id) if has_more else None,
+    })
 
 
 # -------------------------------
@@ -146,9 +318,10 @@ def get_departments(faculty_id):
 def get_modules(department_id):
     """Return all modules available under a department."""
     modules = (
-        Module.query.join(Module.course)
-        .join(Module.course.department)
-        .filter(Module.course.department_id == department_id)
+        db.session.query(Module.id, Module.name)
+        .join(Course, Course.id == Module.course_id)
+        .filter(Course.department_id == department_id)
+        .order_by(Module.name)
         .all()
     )
     return jsonify([{"id": m.id, "name": m.name} for m in modules])
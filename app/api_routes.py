@@ -1,50 +1,40 @@
 # app/api_routes.py
-from flask import Blueprint, jsonify, request
-from .models import Faculty, Department, Course, Module, Student, User
-import numpy as np
-import json
+from collections import namedtuple
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required
+from .models import db, Faculty, Department, Course, Module, Student, User, AttendanceSession
+from .attendance_store import record_attendance
+from .attendance_buffer import attendance_buffer
+from .session_registry import get_session_registry
+from .face_index import get_face_gallery
+
+# Same shape as the (id, student_number, full_name) row /api/scan otherwise queries
+StudentName = namedtuple("StudentName", ["id", "student_number", "full_name"])
 
 api_bp = Blueprint('api_bp', __name__)
 
 # ---------------------- Helper ----------------------
-def compare_face_encodings(stored_encoding, incoming_encoding, tolerance=0.45):
+def session_row(session_id):
+    """Session id, module, course and is_active in one joined query (None if missing)."""
+    return (
+        db.session.query(AttendanceSession.id, AttendanceSession.module_id,
+                         AttendanceSession.is_active, Module.course_id)
+        .join(Module, AttendanceSession.module_id == Module.id)
+        .filter(AttendanceSession.id == session_id)
+        .first()
+    )
+
+def session_scope(session_id):
     """
-    Compare a stored face encoding (NumPy array or JSON string) with an incoming encoding.
-    Returns True if match, otherwise False.
-    
-    This version handles sign flips by using cosine similarity.
+    Gallery search scope for an attendance session's roster.
+    Returns None if the session does not exist.
     """
-    try:
-        # Load stored encoding
-        if isinstance(stored_encoding, str):
-            stored_encoding = np.array(json.loads(stored_encoding), dtype=np.float32)
-        elif isinstance(stored_encoding, list):
-            stored_encoding = np.array(stored_encoding, dtype=np.float32)
-        else:
-            stored_encoding = stored_encoding.astype(np.float32)
-
-        # Ensure incoming encoding is a NumPy array
-        incoming_encoding = np.array(incoming_encoding, dtype=np.float32)
-
-        # Normalize both vectors
-        stored_norm = stored_encoding / np.linalg.norm(stored_encoding)
-        incoming_norm = incoming_encoding / np.linalg.norm(incoming_encoding)
-
-        # Compute cosine similarity
-        cosine_sim = np.dot(stored_norm, incoming_norm)
-        
-        # Print for debugging
-        print("Stored encoding:", stored_norm)
-        print("-------------------------")
-        print("Incoming encoding:", incoming_norm)
-        print("Cosine similarity:", cosine_sim)
-
-        # Check against tolerance (higher similarity = closer match)
-        return cosine_sim >= (1 - tolerance)
-
-    except Exception as e:
-        print(f"Error comparing encodings: {e}")
-        return False
+    session = session_row(session_id)
+    if not session:
+        return None
+    return {"module_id": session.module_id, "course_id": session.course_id}
 
 @api_bp.route('/api/faculties/<int:faculty_id>/departments')
 def get_departments(faculty_id):
@@ -62,6 +52,15 @@ def get_modules(course_id):
     return jsonify([{"id": m.id, "name": m.name} for m in modules])
 
 
+@api_bp.route('/api/face/gallery/stats')
+def face_gallery_stats():
+    return jsonify(get_face_gallery().stats())
+
+@api_bp.route('/api/attendance/sessions/stats')
+def session_registry_stats():
+    return jsonify(get_session_registry().stats())
+
+
 @api_bp.route('/api/face/verify', methods=['POST'])
 def verify_face():
     try:
@@ -75,27 +74,54 @@ def verify_face():
                 "duplicateMatch": False
             }), 400
 
-        incoming_encoding = np.array(incoming_encoding, dtype=np.float32)
-        students = Student.query.join(User).filter(Student.face_encoding.isnot(None)).all()
-        print(f"Total students with face encodings: {len(students)}")
-
-        for student in students:
-            stored = student.face_encoding
-            try:
-                match = compare_face_encodings(stored, incoming_encoding, tolerance=0.5)  # cosine threshold
-                if match:
-                    return jsonify({
-                        "match": True,
-                        "message": f"Match found: {student.user.full_name} signed",
-                        "duplicateMatch": False
-                    }), 200
-            except Exception as e:
-                print(f"Error comparing encodings for {student.user.full_name}: {e}")
-                continue
+        # Scope the search to the roster of the scanner's session, if given
+        scope = {}
+        session_id = data.get("session_id")
+        if session_id:
+            scope = session_scope(session_id)
+            if scope is None:
+                return jsonify({
+                    "match": False,
+                    "message": "Attendance session not found.",
+                    "duplicateMatch": False
+                }), 404
+
+        fallback = data.get("fallback_global", current_app.config["FACE_SESSION_FALLBACK"])
+        threshold = 1 - current_app.config["FACE_MATCH_TOLERANCE"]
+
+        gallery = get_face_gallery()
+        try:
+            # Top-2, so we can tell when the face is enrolled more than once
+            matches = gallery.search(incoming_encoding, k=2, **scope)
+            if scope and fallback and not (matches and matches[0][1] >= threshold):
+                scope = {}
+                matches = gallery.search(incoming_encoding, k=2)
+        except ValueError as e:
+            return jsonify({
+                "match": False,
+                "message": str(e),
+                "duplicateMatch": False
+            }), 400
+
+        # cosine threshold: higher similarity = closer match
+        if matches and matches[0][1] >= threshold:
+            student_id, score = matches[0]
+            student = Student.query.get(student_id)
+            if student:
+                return jsonify({
+                    "match": True,
+                    "message": f"Match found: {student.user.full_name} signed",
+                    "student_id": student.id,
+                    "student_number": student.student_number,
+                    "score": round(score, 4),
+                    "scope": "session" if scope else "global",
+                    "duplicateMatch": len(matches) > 1 and matches[1][1] >= threshold
+                }), 200
 
         return jsonify({
             "match": False,
             "message": "No match found.",
+            "score": round(matches[0][1], 4) if matches else None,
             "duplicateMatch": False
         }), 200
 
@@ -106,4 +132,188 @@ def verify_face():
             "duplicateMatch": False
         }), 500
 
-    
\ No newline at end of file
+
+@api_bp.route('/api/face/verify/batch', methods=['POST'])
+def verify_face_batch():
+    """
+    Verify every face in a classroom frame in one request.
+
+    Body: {"encodings": [[...], [...]], "session_id": optional, "fallback_global": optional}
+    Returns one result per encoding, in order. A bad encoding gets an
+    "error" entry instead of failing the whole batch.
+    """
+    try:
+        data = request.get_json() or {}
+        encodings = data.get("encodings")
+
+        if not isinstance(encodings, list) or not encodings:
+            return jsonify({"msg": "No face encodings provided."}), 400
+        if len(encodings) > current_app.config["FACE_BATCH_LIMIT"]:
+            return jsonify({"msg": f"At most {current_app.config['FACE_BATCH_LIMIT']} encodings per batch."}), 413
+
+        scope = {}
+        session_id = data.get("session_id")
+        if session_id:
+            scope = session_scope(session_id)
+            if scope is None:
+                return jsonify({"msg": "Attendance session not found."}), 404
+
+        fallback = data.get("fallback_global", current_app.config["FACE_SESSION_FALLBACK"])
+        threshold = 1 - current_app.config["FACE_MATCH_TOLERANCE"]
+
+        gallery = get_face_gallery()
+        matches = gallery.search_batch(encodings, k=2, **scope)
+        scopes = ["session" if scope else "global"] * len(encodings)
+
+        if scope and fallback:
+            retry = [
+                i for i, m in enumerate(matches)
+                if not isinstance(m, Exception) and not (m and m[0][1] >= threshold)
+            ]
+            if retry:
+                for i, m in zip(retry, gallery.search_batch([encodings[i] for i in retry], k=2)):
+                    matches[i], scopes[i] = m, "global"
+
+        # One query for the names of everyone matched in the frame
+        matched_ids = {m[0][0] for m in matches if not isinstance(m, Exception) and m and m[0][1] >= threshold}
+        students = {}
+        if matched_ids:
+            rows = (
+                db.session.query(Student.id, Student.student_number, User.full_name)
+                .join(User, Student.id == User.id)
+                .filter(Student.id.in_(matched_ids))
+                .all()
+            )
+            students = {row.id: row for row in rows}
+
+        results = []
+        for i, m in enumerate(matches):
+            if isinstance(m, Exception):
+                results.append({"index": i, "match": False, "error": str(m)})
+                continue
+            student = students.get(m[0][0]) if m and m[0][1] >= threshold else None
+            if student:
+                results.append({
+                    "index": i,
+                    "match": True,
+                    "student_id": student.id,
+                    "student_number": student.student_number,
+                    "full_name": student.full_name,
+                    "score": round(m[0][1], 4),
+                    "scope": scopes[i],
+                    "duplicateMatch": len(m) > 1 and m[1][1] >= threshold
+                })
+            else:
+                results.append({
+                    "index": i,
+                    "match": False,
+                    "score": round(m[0][1], 4) if m else None
+                })
+
+        return jsonify({
+            "results": results,
+            "matched": sum(1 for r in results if r["match"])
+        }), 200
+
+    except Exception as e:
+        return jsonify({"msg": f"Server error: {str(e)}"}), 500
+
+
+@api_bp.route('/api/scan', methods=['POST'])
+@jwt_required()
+def scan_face():
+    """
+    Verify a face and record attendance for it in one request.
+
+    Body: {"session_id": 1, "face_encoding": [...], "fallback_global": optional}
+    The session and earlier scans come from the session registry; the face
+    is matched against the session's roster and the student recorded in the
+    same transaction. "record" is "created" (201), "duplicate" when
+    the student was already marked, or "accepted" in write-behind mode.
+    A match found only by the global fallback is returned with "record":
+    "not_enrolled" and nothing is written: that student is not on the
+    session's roster.
+    """
+    try:
+        data = request.get_json() or {}
+        incoming_encoding = data.get("face_encoding")
+        session_id = data.get("session_id")
+
+        if not incoming_encoding or not session_id:
+            return jsonify({"match": False, "message": "session_id and face_encoding are required."}), 400
+
+        try:
+            session_id = int(session_id)
+        except (TypeError, ValueError):
+            return jsonify({"match": False, "message": "Invalid session_id."}), 400
+
+        registry = get_session_registry()
+        session, state = registry.lookup(session_id)
+        if session is None:
+            if state == "missing":
+                return jsonify({"match": False, "message": "Attendance session not found."}), 404
+            return jsonify({"match": False, "message": "Attendance session is closed."}), 409
+
+        scope = {"module_id": session.module_id, "course_id": session.course_id}
+        fallback = data.get("fallback_global", current_app.config["FACE_SESSION_FALLBACK"])
+        threshold = 1 - current_app.config["FACE_MATCH_TOLERANCE"]
+
+        gallery = get_face_gallery()
+        try:
+            matches = gallery.search(incoming_encoding, k=2, **scope)
+            if fallback and not (matches and matches[0][1] >= threshold):
+                scope = {}
+                matches = gallery.search(incoming_encoding, k=2)
+        except ValueError as e:
+            return jsonify({"match": False, "message": str(e)}), 400
+
+        student = None
+        if matches and matches[0][1] >= threshold:
+            # Roster names are in memory once the session is warmed up
+            name = registry.student_name(session, matches[0][0])
+            if name is not None:
+                student = StudentName(matches[0][0], *name)
+            else:
+                student = (
+                    db.session.query(Student.id, Student.student_number, User.full_name)
+                    .join(User, Student.id == User.id)
+                    .filter(Student.id == matches[0][0])
+                    .first()
+                )
+        if not student:
+            return jsonify({
+                "match": False,
+                "message": "No match found.",
+                "score": round(matches[0][1], 4) if matches else None
+            }), 200
+
+        if not scope:
+            record = "not_enrolled"
+            message = f"{student.full_name} is not enrolled in this session's module"
+        else:
+            if registry.is_recorded(session, student.id):
+                record = "duplicate"
+            elif attendance_buffer.enabled:
+                attendance_buffer.append([(session.id, student.id, datetime.utcnow())])
+                record = "accepted"
+            else:
+                record, = record_attendance([(session.id, student.id, datetime.utcnow())])
+                db.session.commit()
+            registry.mark_recorded(session, [student.id])
+            message = f"{student.full_name} " + ("signed" if record != "duplicate" else "already signed")
+
+        return jsonify({
+            "match": True,
+            "message": message,
+            "student_id": student.id,
+            "student_number": student.student_number,
+            "full_name": student.full_name,
+            "score": round(matches[0][1], 4),
+            "scope": "session" if scope else "global",
+            "duplicateMatch": len(matches) > 1 and matches[1][1] >= threshold,
+            "record": record
+        }), 201 if record == "created" else 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"match": False, "message": f"Server error: {str(e)}"}), 500
@@ -1,7 +1,15 @@
-from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for, current_app, Response
 from flask_login import login_required, current_user
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .models import db, Module, AttendanceSession, AttendanceRecord, Student
+from .models import db, Module, AttendanceSession, AttendanceRecord, Student, User, ScannerSyncKey
+from .attendance_store import record_attendance, parse_marked_at, known_references, known_students, insert_ignore, record_absences
+from .session_registry import get_session_registry, session_registry
+from .live_feed import live_feed
+from .attendance_buffer import attendance_buffer
 
 attendance_bp = Blueprint("attendance_bp", __name__)
 
@@ -17,9 +25,19 @@ def start_session():
             flash("Please select a module", "danger")
             return redirect(url_for("attendance_bp.start_session"))
 
-        session = AttendanceSession(module_id=module_id, lecturer_id=current_user.id)
+        # Length in minutes (default ATTENDANCE_DEFAULT_DURATION); the scheduler closes the session after it
+        duration = request.form.get("duration_minutes", type=int)
+        if not duration or duration <= 0:
+            duration = current_app.config["ATTENDANCE_DEFAULT_DURATION"]
+        start_time = datetime.utcnow()
+        end_time = start_time + timedelta(minutes=duration) if duration > 0 else None
+
+        session = AttendanceSession(module_id=module_id, lecturer_id=current_user.id,
+                                    start_time=start_time, end_time=end_time)
         db.session.add(session)
         db.session.commit()
+        # Load the roster now so the first scans do not pay for it
+        session_registry.prewarm(current_app._get_current_object(), session.id)
 
         flash("Attendance session started", "success")
         return redirect(url_for("attendance_bp.monitor", session_id=session.id))
@@ -42,7 +60,7 @@ def start_session():
 def monitor(session_id):
     session = AttendanceSession.query.get_or_404(session_id)
     records = AttendanceRecord.query.filter_by(session_id=session_id)\
-        .order_by(AttendanceRecord.timestamp.desc()).all()
+        .order_by(AttendanceRecord.marked_at.desc()).all()
     return render_template("attendance_monitor.html", session=session, records=records)
 
 # ----------------------
@@ -53,7 +71,11 @@ def monitor(session_id):
 def stop_session(session_id):
     session = AttendanceSession.query.get_or_404(session_id)
     session.is_active = False
-    session.ended_at = db.func.now()
+    now = datetime.utcnow()
+    if session.end_time is None or session.end_time > now:
+        session.end_time = now
+    # Everyone on the roster who did not scan is recorded absent
+    record_absences(AttendanceSession.__table__.c.id == session.id, marked_at=now)
     db.session.commit()
     flash("Attendance session stopped", "info")
     return redirect(url_for("main_bp.dashboard"))
@@ -72,34 +94,341 @@ def api_record_attendance():
     if not session_id or not student_id:
         return jsonify({"msg":"Missing required fields"}), 400
 
-    # Prevent duplicate attendance records
-    existing = AttendanceRecord.query.filter_by(session_id=session_id, student_id=student_id).first()
-    if existing:
+    try:
+        session_id, student_id = int(session_id), int(student_id)
+    except (TypeError, ValueError):
+        return jsonify({"msg":"Invalid session or student id"}), 400
+
+    # Session state and earlier scans are answered from memory when possible
+    registry = get_session_registry()
+    session, state = registry.lookup(session_id)
+    if session is None:
+        if state == "missing":
+            return jsonify({"msg":"Attendance session not found"}), 404
+        return jsonify({"msg":"Attendance session is closed"}), 409
+    if registry.is_recorded(session, student_id):
         return jsonify({"msg":"Attendance already recorded"}), 409
+    # INSERT IGNORE would also skip a row failing its student foreign key
+    if not known_students([student_id]):
+        return jsonify({"msg":"Student not found"}), 404
 
-    rec = AttendanceRecord(session_id=session_id, student_id=student_id, status="present")
-    db.session.add(rec)
+    if attendance_buffer.enabled:
+        # Acknowledged once on disk; duplicates are dropped when flushed
+        attendance_buffer.append([(session_id, student_id, datetime.utcnow())])
+        registry.mark_recorded(session, [student_id])
+        return jsonify({"msg":"Attendance accepted"}), 202
+
+    # The unique (session_id, student_id) constraint decides, so two
+    # concurrent scans of the same student cannot both be recorded
+    status, = record_attendance([(session_id, student_id, datetime.utcnow())])
     db.session.commit()
+    registry.mark_recorded(session, [student_id])
+    if status == "duplicate":
+        return jsonify({"msg":"Attendance already recorded"}), 409
     return jsonify({"msg":"Attendance recorded successfully"}), 201
 
+# ----------------------
+# API: Record many scans at once (mobile / scanner)
+# ----------------------
+@attendance_bp.route("/api/record/batch", methods=["POST"])
+@jwt_required()
+def api_record_attendance_batch():
+    """
+    Body: {"records": [{"session_id": 1, "student_id": 2, "marked_at": optional ISO-8601}, ...]}
+    Everything is written with one INSERT and one commit. Returns a status
+    per record, in order: "created", "duplicate" or "error".
+    """
+    data = request.get_json() or {}
+    records = data.get("records")
+
+    if not isinstance(records, list) or not records:
+        return jsonify({"msg":"No attendance records provided"}), 400
+    limit = current_app.config["ATTENDANCE_BATCH_LIMIT"]
+    if len(records) > limit:
+        return jsonify({"msg":f"At most {limit} records per batch"}), 413
+
+    results = [{"index": i} for i in range(len(records))]
+    items, positions = [], []
+    for i, record in enumerate(records):
+        try:
+            session_id = int(record["session_id"])
+            student_id = int(record["student_id"])
+            marked_at = parse_marked_at(record.get("marked_at"))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            results[i].update(status="error", error="Invalid record")
+            continue
+        results[i].update(session_id=session_id, student_id=student_id)
+        items.append((session_id, student_id, marked_at))
+        positions.append(i)
+
+    # Closed/unknown sessions and known duplicates are settled from memory;
+    # unknown students are reported per item instead of failing the insert
+    registry = get_session_registry()
+    students = known_students(item[1] for item in items) if items else set()
+    valid = []
+    for item, i in zip(items, positions):
+        session, state = registry.lookup(item[0])
+        if session is None:
+            results[i].update(status="error", error="Attendance session not found"
+                              if state == "missing" else "Attendance session is closed")
+        elif item[1] not in students:
+            results[i].update(status="error", error="Student not found")
+        elif registry.is_recorded(session, item[1]):
+            results[i]["status"] = "duplicate"
+        else:
+            valid.append((item, i, session))
+
+    if valid:
+        statuses = record_attendance([item for item, _, _ in valid])
+        db.session.commit()
+        for (item, i, session), status in zip(valid, statuses):
+            results[i]["status"] = status
+            registry.mark_recorded(session, [item[1]])
+
+    return jsonify({
+        "results": results,
+        "created": sum(r.get("status") == "created" for r in results),
+        "duplicates": sum(r.get("status") == "duplicate" for r in results),
+    })
+
+# ----------------------
+# API: Offline scanner sync
+# ----------------------
+def read_json_body(max_bytes):
+    """
+    Request JSON, gunzipped when sent with Content-Encoding: gzip.
+    Returns None when the body is not valid JSON or inflates past max_bytes.
+    """
+    if (request.content_length or 0) > max_bytes:
+        return None
+    body = request.get_data(cache=False)
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        inflater = zlib.decompressobj(wbits=31)
+        try:
+            body = inflater.decompress(body, max_bytes + 1)
+        except zlib.error:
+            return None
+        if len(body) > max_bytes or inflater.unconsumed_tail:
+            return None
+    if len(body) > max_bytes:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+@attendance_bp.route("/api/sync", methods=["POST"])
+@jwt_required()
+def api_sync_attendance():
+    """
+    Upload scans captured while a scanner was offline.
+
+    Body (optionally gzip-compressed):
+      {"device_id": "hall-3", "records": [{"key": "<uuid>", "session_id": 1,
+       "student_id": 2, "captured_at": "2026-03-02T08:01:12Z"}, ...]}
+
+    ``key`` is generated by the device once per scan. A key seen before
+    returns its original outcome with "replayed": true instead of being
+    written again, so a chunk can be retried safely after a dropped
+    connection. Each chunk costs one key lookup, one INSERT of records,
+    one INSERT of keys and one commit.
+
+    A scan captured outside its session (start_time to end_time, or now
+    for an open session, give or take ATTENDANCE_SYNC_CLOCK_SKEW) is an
+    "error": it could otherwise turn an absence in a closed session into
+    a presence.
+    """
+    data = read_json_body(current_app.config["ATTENDANCE_SYNC_MAX_BYTES"])
+    if not isinstance(data, dict):
+        return jsonify({"msg":"Invalid or oversized sync payload"}), 400
+    records = data.get("records")
+    if not isinstance(records, list) or not records:
+        return jsonify({"msg":"No attendance records provided"}), 400
+    limit = current_app.config["ATTENDANCE_BATCH_LIMIT"]
+    if len(records) > limit:
+        return jsonify({"msg":f"At most {limit} records per chunk"}), 413
+    device_id = str(data.get("device_id") or "")[:64] or None
+
+    results = [{"index": i} for i in range(len(records))]
+    fresh = {}  # key -> (index, item)
+    for i, record in enumerate(records):
+        try:
+            key = str(record["key"])
+            session_id = int(record["session_id"])
+            student_id = int(record["student_id"])
+            captured_at = parse_marked_at(record.get("captured_at"))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            results[i].update(status="error", error="Invalid record")
+            continue
+        if not key or len(key) > 64:
+            results[i].update(status="error", error="Invalid key")
+            continue
+        results[i]["key"] = key
+        if key in fresh:
+            results[i].update(status="error", error="Key repeated in chunk")
+            continue
+        fresh[key] = (i, (session_id, student_id, captured_at))
+
+    # Keys synced by an earlier (possibly interrupted) upload
+    if fresh:
+        for row in ScannerSyncKey.query.filter(ScannerSyncKey.key.in_(fresh.keys())):
+            i, _ = fresh.pop(row.key)
+            results[i].update(status=row.status, replayed=True)
+
+    if fresh:
+        known_sessions, known_students = known_references([item for _, item in fresh.values()])
+        skew = timedelta(seconds=current_app.config["ATTENDANCE_SYNC_CLOCK_SKEW"])
+        now = datetime.utcnow()
+        valid = []
+        for key, (i, item) in fresh.items():
+            window = known_sessions.get(item[0])
+            if window is None:
+                results[i].update(status="error", error="Attendance session not found")
+            elif not window[0] - skew <= item[2] <= (window[1] or now) + skew:
+                results[i].update(status="error", error="Captured outside the attendance session")
+            elif item[1] not in known_students:
+                results[i].update(status="error", error="Student not found")
+            else:
+                valid.append((key, i, item))
+
+        if valid:
+            statuses = record_attendance([item for _, _, item in valid])
+            insert_ignore(ScannerSyncKey.__table__, [
+                {"key": key, "device_id": device_id, "session_id": item[0], "student_id": item[1],
+                 "status": status, "captured_at": item[2], "synced_at": datetime.utcnow()}
+                for (key, _, item), status in zip(valid, statuses)
+            ])
+            db.session.commit()
+            for (_, i, _), status in zip(valid, statuses):
+                results[i].update(status=status, replayed=False)
+
+    return jsonify({
+        "results": results,
+        "created": sum(r.get("status") == "created" and not r.get("replayed") for r in results),
+        "duplicates": sum(r.get("status") == "duplicate" and not r.get("replayed") for r in results),
+        "replayed": sum(bool(r.get("replayed")) for r in results),
+    })
+
+# ----------------------
+# API: Live session feed (Server-Sent Events)
+# ----------------------
+@attendance_bp.route("/api/session/<int:session_id>/stream")
+@login_required
+def api_session_stream(session_id):
+    """
+    Push a session's attendance records as they are committed.
+
+    Sends every record newer than ?after=<record id> (or the Last-Event-ID
+    header when the browser reconnects), then each new or changed record
+    (e.g. absent -> present) as a "record" event. Backed by app.live_feed,
+    so watchers share one query.
+    Needs a threaded server (the dev server, or gunicorn gthread/gevent).
+    """
+    AttendanceSession.query.get_or_404(session_id)
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    except ValueError:
+        after = 0
+    app = current_app._get_current_object()
+    keepalive = app.config["ATTENDANCE_FEED_KEEPALIVE"]
+
+    def stream():
+        channel = live_feed.subscribe(app, session_id)
+        try:
+            position = live_feed.start_position(channel, after)
+            yield "retry: 3000\n\n"
+            while True:
+                events = live_feed.wait(channel, position, keepalive)
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                position += len(events)
+                chunk = []
+                for record_id, payload in events:
+                    # Ids arrive out of order; a reconnect resumes after the last one sent
+                    chunk.append(f"id: {record_id}\nevent: record\ndata: {payload}\n\n")
+                yield "".join(chunk)
+        finally:
+            live_feed.unsubscribe(channel)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ----------------------
 # API: Get session records (dashboard polling)
 # ----------------------
+def encode_cursor(marked_at, record_id):
+    return f"{marked_at.isoformat()}_{record_id}"
+
+def decode_cursor(cursor):
+    """"<marked_at ISO>_<record id>" -> (datetime, id); raises ValueError."""
+    marked_at, _, record_id = cursor.rpartition("_")
+    return datetime.fromisoformat(marked_at), int(record_id)
+
 @attendance_bp.route("/api/session/<int:session_id>/records")
 @login_required
 def api_session_records(session_id):
-    records = AttendanceRecord.query.filter_by(session_id=session_id)\
-        .order_by(AttendanceRecord.timestamp.desc()).all()
-    output = []
-    for r in records:
-        student = Student.query.get(r.student_id)
-        output.append({
-            "student_name": student.user.full_name if student else "Unknown",
-            "student_number": student.student_number if student else "Unknown",
-            "timestamp": r.timestamp.isoformat(),
-            "status": r.status
-        })
-    return jsonify(output)
+    """
+    A session's records from one joined, column-only query.
+
+      ?since=<cursor>   records after the cursor, oldest first (the delta)
+      ?before=<cursor>  older records, newest first (next page)
+      neither           the newest records first
+      ?limit=N          page size (default 200, at most 1000)
+
+    Cursors are "<marked_at>_<id>" strings. "cursor" in the response is
+    what to send as ``since`` next time. "next" pages on in the same
+    direction and is null on the last page. Scans uploaded later by an
+    offline scanner keep the device's marked_at, so they can land behind
+    a ``since`` cursor; the live stream (api_session_stream) has them.
+    Legacy records without a marked_at have no place in the cursor order
+    and are left out.
+
+    The response is {"records", "cursor", "next"}; it used to be a bare
+    list of records.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", 200)), 1), 1000)
+        since = decode_cursor(request.args["since"]) if request.args.get("since") else None
+        before = decode_cursor(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"msg":"Invalid cursor or limit"}), 400
+
+    key = db.tuple_(AttendanceRecord.marked_at, AttendanceRecord.id)
+    query = (
+        db.session.query(
+            AttendanceRecord.id, AttendanceRecord.marked_at, AttendanceRecord.status,
+            Student.student_number, User.full_name,
+        )
+        .outerjoin(Student, AttendanceRecord.student_id == Student.id)
+        .outerjoin(User, Student.id == User.id)
+        .filter(AttendanceRecord.session_id == session_id, AttendanceRecord.marked_at.isnot(None))
+    )
+    if since:
+        query = query.filter(key > since).order_by(AttendanceRecord.marked_at, AttendanceRecord.id)
+    else:
+        if before:
+            query = query.filter(key < before)
+        query = query.order_by(AttendanceRecord.marked_at.desc(), AttendanceRecord.id.desc())
 
+    # One extra row tells us whether another page exists
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
+    output = [{
+        "id": r.id,
+        "student_name": r.full_name or "Unknown",
+        "student_number": r.student_number or "Unknown",
+        "timestamp": r.marked_at.isoformat(),
+        "status": r.status
+    } for r in rows]
 
+    newest = (rows[-1] if since else rows[0]) if rows else None
+    cursor = encode_cursor(newest.marked_at, newest.id) if newest else request.args.get("since")
+    return jsonify({
+        "records": output,
+        "cursor": cursor,
+        "next": encode_cursor(rows[-1].marked_at, rows[-1].id) if has_more else None,
+    })
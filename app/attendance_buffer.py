@@ -0,0 +1,258 @@
+# app/attendance_buffer.py
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+from .models import db
+from .attendance_store import record_attendance, known_references
+
+
+def fsync_directory(path):
+    """Make file creations in ``path`` durable (a new file's name lives in its directory)."""
+    if fcntl is None:
+        return  # Windows cannot open a directory to fsync it
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def remove_log(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class AttendanceBuffer:
+    """
+    Write-behind buffer for attendance scans (ATTENDANCE_WRITE_BEHIND).
+
+    A scan is acknowledged once it is fsync'ed to a local append log;
+    a background thread then writes buffered scans to attendance_records
+    with one INSERT and one COMMIT per ATTENDANCE_FLUSH_SIZE scans or
+    every ATTENDANCE_FLUSH_INTERVAL seconds, whichever comes first.
+
+    Concurrent requests share fsyncs (group commit): whoever syncs the
+    log covers every line written before it, so the others return
+    without syncing again.
+
+    Each process appends to its own log file in ATTENDANCE_LOG_DIR. When
+    a flush starts, the current file is sealed and a new one opened; the
+    sealed file is deleted only after its scans are committed. Files left
+    behind by a crash are replayed when the process serves its first
+    request, which is also when the flush thread starts, so scripts and
+    CLI commands that build the app never touch the log. Replaying a file
+    that was already committed is harmless because duplicate scans are
+    ignored.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._pending = []
+        self._sealed = []  # (path, items, file) not yet committed
+        self._written = 0
+        self._synced = 0
+        self._segment = 0
+
+    # ---------------------- Setup ----------------------
+    def init_app(self, app):
+        if not app.config["ATTENDANCE_WRITE_BEHIND"] or self.app is not None:
+            return
+        self.app = app
+        self.directory = app.config["ATTENDANCE_LOG_DIR"] or os.path.join(app.instance_path, "attendance_log")
+        self.flush_size = app.config["ATTENDANCE_FLUSH_SIZE"]
+        self.flush_interval = app.config["ATTENDANCE_FLUSH_INTERVAL"]
+
+        @app.before_request
+        def start_attendance_buffer():
+            if not self.enabled:
+                self.start()
+
+    def start(self):
+        """Replay logs left behind and start the flush thread (once)."""
+        with self._start_lock:
+            if self.enabled:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._open_segment()
+            self.replay()
+
+            self._thread = threading.Thread(target=self._run, name="attendance-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+            self.enabled = True
+            print(f"✅ Attendance write-behind enabled ({self.directory})")
+
+    def _open_segment(self):
+        self._segment += 1
+        path = os.path.join(self.directory, f"scans-{os.getpid()}-{time.time_ns()}-{self._segment}.log")
+        log = open(path, "a", encoding="utf-8")
+        if fcntl is not None:
+            # Held for the life of the file so other workers never replay it
+            fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Scans are acknowledged once the file is fsync'ed; its name must survive a crash too
+        fsync_directory(self.directory)
+        self._path, self._file = path, log
+
+    # ---------------------- Write path ----------------------
+    def append(self, items):
+        """
+        Durably log ``(session_id, student_id, marked_at)`` items. Returns
+        once they are on disk; the database write happens later.
+        """
+        lines = "".join(
+            json.dumps({"session_id": s, "student_id": st, "marked_at": m.isoformat()}) + "\n"
+            for s, st, m in items
+        )
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            self._written += 1
+            ticket = self._written
+            log = self._file
+            self._pending.extend(items)
+            if len(self._pending) >= self.flush_size:
+                self._wake.set()
+        self._sync(log, ticket)
+
+    def _sync(self, log, ticket):
+        # Lock order everywhere: _sync_lock, then _lock
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return
+            with self._lock:
+                covered = self._written
+            # Sealing a segment fsyncs it first, so a closed file is already durable
+            if not log.closed:
+                os.fsync(log.fileno())
+            self._synced = max(self._synced, covered)
+
+    # ---------------------- Flushing ----------------------
+    def _seal(self):
+        """fsync and close off the current segment, then start a new one."""
+        with self._sync_lock, self._lock:
+            if not self._pending:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = self._written
+            sealed = (self._path, self._pending, self._file)
+            # Open the next segment first: if that fails, keep logging to this one
+            self._open_segment()
+            self._sealed.append(sealed)
+            self._pending = []
+
+    def flush(self):
+        """Commit every sealed segment, oldest first; stop at the first failure."""
+        self._seal()
+        while self._sealed:
+            path, items, log = self._sealed[0]
+            try:
+                with self.app.app_context():
+                    self._write(items)
+            except Exception as e:
+                print(f"❌ Attendance flush failed, will retry: {e}")
+                return False
+            self._sealed.pop(0)
+            # Unlink while still holding the lock, so no other worker can
+            # pick the file up for replay in between
+            remove_log(path)
+            log.close()  # releases the lock
+        return True
+
+    @staticmethod
+    def _write(items):
+        sessions, students = known_references(items)
+        valid = [item for item in items if item[0] in sessions and item[1] in students]
+        if len(valid) < len(items):
+            print(f"Dropping {len(items) - len(valid)} buffered scans for unknown sessions/students")
+        try:
+            if valid:
+                record_attendance(valid)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # e.g. sealing failed to fsync or open a segment; keep the thread alive
+                print(f"❌ Attendance flush error, will retry: {e}")
+
+    def replay(self):
+        """
+        Commit scans from log files left behind by a previous run. A file
+        that cannot be committed is kept for the next startup.
+        """
+        for path in sorted(glob.glob(os.path.join(self.directory, "scans-*.log"))):
+            if path == self._path:
+                continue
+            try:
+                self._replay_file(path)
+            except FileNotFoundError:
+                continue  # committed and removed by its owner meanwhile
+            except Exception as e:
+                print(f"❌ Could not replay {os.path.basename(path)}, keeping it: {e}")
+
+    def _replay_file(self, path):
+        with open(path, "r+", encoding="utf-8") as log:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return  # another live worker's log
+            if os.fstat(log.fileno()).st_nlink == 0:
+                return  # committed and unlinked by its owner after we opened it
+            items = []
+            for line in log:
+                try:
+                    record = json.loads(line)
+                    items.append((record["session_id"], record["student_id"],
+                                  datetime.fromisoformat(record["marked_at"])))
+                except (ValueError, KeyError):
+                    continue  # torn last line from a crash mid-write
+            if items:
+                with self.app.app_context():
+                    self._write(items)
+                print(f"Replayed {len(items)} buffered attendance scans from {os.path.basename(path)}")
+            remove_log(path)  # before the lock is released on close
+
+    def close(self):
+        """Stop the flusher and commit whatever is buffered."""
+        if not self.enabled:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self.flush()
+        self.enabled = False
+
+
+attendance_buffer = AttendanceBuffer()
@@ -0,0 +1,401 @@
+# app/attendance_store.py
+from datetime import datetime
+
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from .models import db, AttendanceRecord, AttendanceSession, AttendanceSummary, Module, Student
+
+
+# ---------------------- Helper ----------------------
+def ignoring_insert(table, dialect):
+    """An INSERT into ``table`` that skips rows hitting a unique constraint."""
+    if dialect.name == "mysql":
+        return mysql.insert(table).prefix_with("IGNORE")
+    if dialect.name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect.name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    raise NotImplementedError(f"insert_ignore does not support {dialect.name}")
+
+
+def insert_ignore(table, rows, returning=(), connection=None):
+    """
+    One multi-row INSERT of ``rows`` that skips rows hitting a unique
+    constraint instead of failing the statement. Runs on ``connection``
+    when given (e.g. inside a flush hook), else on db.session.
+
+    Returns the ``returning`` columns of the inserted rows when the
+    database supports INSERT ... RETURNING, or when the affected row count
+    settles it (all rows or none inserted, e.g. a single row); otherwise
+    None.
+    """
+    executor = connection if connection is not None else db.session
+    dialect = connection.dialect if connection is not None else db.session.get_bind().dialect
+    statement = ignoring_insert(table, dialect)
+
+    if returning and dialect.insert_returning:
+        result = executor.execute(statement.values(rows).returning(*returning))
+        return result.all()
+    result = executor.execute(statement.values(rows))
+    if returning and result.rowcount == len(rows):
+        return [tuple(row[column.name] for column in returning) for row in rows]
+    if returning and result.rowcount == 0:
+        return []
+    return None
+
+
+def parse_marked_at(value):
+    """ISO-8601 string -> naive UTC datetime (None = now)."""
+    if value in (None, ""):
+        return datetime.utcnow()
+    marked_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if marked_at.tzinfo is not None:
+        marked_at = (marked_at - marked_at.utcoffset()).replace(tzinfo=None)
+    return marked_at
+
+
+def known_students(student_ids):
+    """The ids in ``student_ids`` that belong to a student (one query)."""
+    return {row.id for row in db.session.query(Student.id).filter(Student.id.in_(set(student_ids)))}
+
+
+def known_references(items):
+    """
+    The sessions and students in ``items`` that exist (two queries):
+    ``({session_id: (start_time, end_time)}, {student_id, ...})``.
+    """
+    sessions = {
+        row.id: (row.start_time, row.end_time)
+        for row in db.session.query(AttendanceSession.id, AttendanceSession.start_time, AttendanceSession.end_time)
+        .filter(AttendanceSession.id.in_({item[0] for item in items}))
+    }
+    return sessions, known_students(item[1] for item in items)
+
+
+# ------------------------------------------------------------
+# Bulk attendance writes
+# ------------------------------------------------------------
+def record_attendance(items, status="present"):
+    """
+    Write many ``(session_id, student_id, marked_at)`` tuples in one INSERT.
+
+    Relies on the unique (session_id, student_id) constraint, so concurrent
+    writers can never create the same record twice. Returns "created" or
+    "duplicate" for each item, in order; a pair repeated within ``items``
+    is created once and reported as a duplicate after that.
+
+    An "absent" record written when the session closed is turned into this
+    one if the scan was captured before it (a buffered or offline scan
+    that reached the database late), and reported as created.
+
+    Does not commit.
+    """
+    statuses = [None] * len(items)
+    first_seen = {}
+    for i, (session_id, student_id, _) in enumerate(items):
+        key = (session_id, student_id)
+        if key in first_seen:
+            statuses[i] = "duplicate"
+        else:
+            first_seen[key] = i
+    if not first_seen:
+        return statuses
+
+    # Pairs recorded before this batch (one query for the whole batch)
+    session_ids = {key[0] for key in first_seen}
+    student_ids = {key[1] for key in first_seen}
+    existing = {
+        (row.session_id, row.student_id): row
+        for row in db.session.query(AttendanceRecord.session_id, AttendanceRecord.student_id,
+                                    AttendanceRecord.status, AttendanceRecord.marked_at)
+        .filter(AttendanceRecord.session_id.in_(session_ids), AttendanceRecord.student_id.in_(student_ids))
+    }
+
+    table = AttendanceRecord.__table__
+    rows, late = [], []
+    for key, i in first_seen.items():
+        found = existing.get(key)
+        if found is None:
+            rows.append({"session_id": key[0], "student_id": key[1], "marked_at": items[i][2], "status": status})
+        elif found.status == "absent" and status != "absent" and items[i][2] <= found.marked_at:
+            late.append({"s_id": key[0], "st_id": key[1], "s_marked_at": items[i][2], "s_status": status})
+            statuses[i] = "created"
+        else:
+            statuses[i] = "duplicate"
+
+    if late:
+        # One executemany UPDATE; the status guard keeps it safe against a racing writer
+        db.session.execute(
+            table.update()
+            .where(table.c.session_id == db.bindparam("s_id"), table.c.student_id == db.bindparam("st_id"),
+                   table.c.status == "absent")
+            .values(status=db.bindparam("s_status"), marked_at=db.bindparam("s_marked_at")),
+            late,
+        )
+    if not rows:
+        refresh_for_records(late)
+        return statuses
+
+    inserted = insert_ignore(table, rows, returning=(table.c.session_id, table.c.student_id))
+    exact = inserted is not None
+    if not exact:
+        # No RETURNING (MySQL) and only some rows of the batch inserted: a pair
+        # inserted by another request between the SELECT above and this INSERT
+        # is ignored but reported created
+        inserted = [(row["session_id"], row["student_id"]) for row in rows]
+    inserted = {tuple(pair) for pair in inserted}
+    for row in rows:
+        key = (row["session_id"], row["student_id"])
+        statuses[first_seen[key]] = "created" if key in inserted else "duplicate"
+
+    if exact:
+        # New records only add to their summaries; no need to recount them
+        modules = dict(
+            db.session.query(AttendanceSession.id, AttendanceSession.module_id)
+            .filter(AttendanceSession.id.in_({session_id for session_id, _ in inserted}))
+        ) if inserted else {}
+        deltas = {}
+        for session_id, student_id in inserted:
+            key = (student_id, modules[session_id])
+            sessions, attended, marks = deltas.get(key, (0, 0, 0))
+            deltas[key] = (sessions + 1, attended + (status == "present"), marks)
+        increment_summaries(deltas)
+        refresh_for_records(late)
+    else:
+        refresh_for_records([{"s_id": session_id, "st_id": student_id} for session_id, student_id in inserted] + late)
+    return statuses
+
+
+def record_absences(*session_filter, marked_at=None):
+    """
+    Insert an "absent" record for every rostered student of the sessions
+    matching ``session_filter`` who has no record yet, in one
+    INSERT ... SELECT. The roster is the same as the face scope: students
+    of the session's module, or of that module's course.
+
+    Rows that race a scan are skipped rather than failing the statement.
+    The new rows are then added to the summaries (+1 session each) with one
+    INSERT ... SELECT upsert; they are the only "absent" rows of these
+    sessions with this call's changed_at. Returns the number of records
+    written. Does not commit.
+    """
+    sessions = AttendanceSession.__table__
+    modules = Module.__table__
+    students = Student.__table__
+    records = AttendanceRecord.__table__
+
+    recorded = db.select(records.c.id).where(
+        records.c.session_id == sessions.c.id, records.c.student_id == students.c.id
+    )
+    # Whole seconds: MySQL DATETIME drops the fraction, and changed_at must compare equal below
+    now = datetime.utcnow().replace(microsecond=0)
+    roster = (
+        db.select(
+            sessions.c.id, students.c.id, db.literal("absent"),
+            db.literal(marked_at or now, db.DateTime), db.literal(0), db.literal(now, db.DateTime),
+        )
+        .select_from(
+            sessions.join(modules, modules.c.id == sessions.c.module_id)
+            .join(students, db.or_(students.c.module_id == sessions.c.module_id,
+                                   students.c.course_id == modules.c.course_id))
+        )
+        .where(*session_filter, ~db.exists(recorded))
+    )
+    statement = ignoring_insert(records, db.session.get_bind().dialect).from_select(
+        ["session_id", "student_id", "status", "marked_at", "attendance_marks", "changed_at"], roster
+    )
+    written = db.session.execute(statement).rowcount
+    if written:
+        db.session.execute(summary_increment(
+            summary_select(records.c.status == "absent", records.c.changed_at == now, *session_filter)
+        ))
+    return written
+
+
+# ------------------------------------------------------------
+# Bulk marks
+# ------------------------------------------------------------
+def set_marks(module_id, entries):
+    """
+    Write ``(student_id, session_id, marks)`` entries for one module with a
+    single executemany UPDATE. Only present records of the module's
+    sessions get marks. Returns ``{"updated": n, "not_present": [...],
+    "missing": [...]}``; the lists hold the entries skipped. Does not commit.
+    """
+    latest = {}
+    for student_id, session_id, marks in entries:
+        latest[(session_id, student_id)] = marks  # the last entry for a pair wins
+
+    records = AttendanceRecord.__table__
+    found = {
+        (row.session_id, row.student_id): row.status
+        for row in db.session.query(AttendanceRecord.session_id, AttendanceRecord.student_id, AttendanceRecord.status)
+        .join(AttendanceSession, AttendanceRecord.session_id == AttendanceSession.id)
+        .filter(AttendanceSession.module_id == module_id,
+                AttendanceRecord.session_id.in_({key[0] for key in latest}),
+                AttendanceRecord.student_id.in_({key[1] for key in latest}))
+    }
+
+    params, not_present, missing = [], [], []
+    for (session_id, student_id), marks in latest.items():
+        entry = {"student_id": student_id, "session_id": session_id}
+        status = found.get((session_id, student_id))
+        if status is None:
+            missing.append(entry)
+        elif status != "present":
+            not_present.append(entry)
+        else:
+            params.append({"s_id": session_id, "st_id": student_id, "s_marks": marks})
+
+    if params:
+        db.session.execute(
+            records.update()
+            .where(records.c.session_id == db.bindparam("s_id"), records.c.student_id == db.bindparam("st_id"),
+                   records.c.status == "present")
+            .values(attendance_marks=db.bindparam("s_marks")),
+            params,
+        )
+        refresh_summaries([module_id], {param["st_id"] for param in params})
+    return {"updated": len(params), "not_present": not_present, "missing": missing}
+
+
+def apply_marks_rule(module_id, per_present):
+    """
+    Give every record of the module ``per_present`` marks if present and 0
+    otherwise, in one UPDATE. Returns the number of records written.
+    Does not commit.
+    """
+    records = AttendanceRecord.__table__
+    sessions = AttendanceSession.__table__
+    result = db.session.execute(
+        records.update()
+        .where(records.c.session_id.in_(db.select(sessions.c.id).where(sessions.c.module_id == module_id)))
+        .values(attendance_marks=db.case((records.c.status == "present", per_present), else_=0))
+    )
+    refresh_summaries([module_id])
+    return result.rowcount
+
+
+# ------------------------------------------------------------
+# Attendance summaries
+# ------------------------------------------------------------
+SUMMARY_COLUMNS = ["student_id", "module_id", "sessions", "attended", "marks"]
+
+
+def summary_select(*conditions):
+    """
+    ``(student_id, module_id, sessions, attended, marks)`` aggregated from
+    the attendance records matching ``conditions``, one row per pair.
+    """
+    records = AttendanceRecord.__table__
+    sessions = AttendanceSession.__table__
+    return (
+        db.select(
+            records.c.student_id,
+            sessions.c.module_id,
+            db.func.count(records.c.id),
+            db.func.coalesce(db.func.sum(db.case((records.c.status == "present", 1), else_=0)), 0),
+            db.func.coalesce(db.func.sum(records.c.attendance_marks), 0),
+        )
+        .select_from(records.join(sessions, sessions.c.id == records.c.session_id))
+        .where(*conditions)
+        .group_by(records.c.student_id, sessions.c.module_id)
+    )
+
+
+def refresh_summaries(module_ids, student_ids=None):
+    """
+    Recompute the summaries of ``student_ids`` (default: every student) in
+    ``module_ids`` (ids or a SELECT of ids) from attendance_records, with
+    one DELETE and one INSERT ... SELECT. Does not commit.
+    """
+    summaries = AttendanceSummary.__table__
+    records = AttendanceRecord.__table__
+    sessions = AttendanceSession.__table__
+
+    delete = summaries.delete().where(summaries.c.module_id.in_(module_ids))
+    conditions = [sessions.c.module_id.in_(module_ids)]
+    if student_ids is not None:
+        delete = delete.where(summaries.c.student_id.in_(student_ids))
+        conditions.append(records.c.student_id.in_(student_ids))
+    db.session.execute(delete)
+    # A concurrent refresh of the same pair may insert first; both counted the same records
+    db.session.execute(
+        ignoring_insert(summaries, db.session.get_bind().dialect).from_select(SUMMARY_COLUMNS, summary_select(*conditions))
+    )
+
+
+def summary_increment(rows):
+    """
+    An upsert adding ``rows`` (a list of SUMMARY_COLUMNS dicts, or a SELECT
+    of SUMMARY_COLUMNS) to their summaries, creating missing rows.
+    """
+    table = AttendanceSummary.__table__
+    dialect = db.session.get_bind().dialect
+    if dialect.name == "mysql":
+        statement = mysql.insert(table)
+    elif dialect.name in ("postgresql", "sqlite"):
+        statement = (postgresql if dialect.name == "postgresql" else sqlite).insert(table)
+    else:
+        raise NotImplementedError(f"increment_summaries does not support {dialect.name}")
+    if isinstance(rows, list):
+        statement = statement.values(rows)
+    else:
+        statement = statement.from_select(SUMMARY_COLUMNS, rows)
+    if dialect.name == "mysql":
+        return statement.on_duplicate_key_update(
+            {name: table.c[name] + statement.inserted[name] for name in SUMMARY_COLUMNS[2:]}
+        )
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.student_id, table.c.module_id],
+        set_={name: table.c[name] + statement.excluded[name] for name in SUMMARY_COLUMNS[2:]},
+    )
+
+
+def increment_summaries(deltas):
+    """
+    Add ``{(student_id, module_id): (sessions, attended, marks)}`` deltas
+    to their summaries with one multi-row upsert, creating missing rows.
+    Does not commit.
+    """
+    if not deltas:
+        return
+    rows = [
+        {"student_id": student_id, "module_id": module_id, "sessions": sessions, "attended": attended, "marks": marks}
+        for (student_id, module_id), (sessions, attended, marks) in deltas.items()
+    ]
+    db.session.execute(summary_increment(rows))
+
+
+def seed_summaries():
+    """
+    Build attendance_summaries from attendance_records when the table is
+    empty but records exist (a database from before the table was added).
+    Scans only ever add to existing summaries, so they need this starting
+    point. Returns the number of rows written. Commits.
+    """
+    if not db.inspect(db.engine).has_table(AttendanceSummary.__tablename__):
+        return 0  # before db.create_all()
+    if db.session.query(AttendanceSummary.student_id).first() is not None:
+        return 0
+    if db.session.query(AttendanceRecord.id).first() is None:
+        return 0
+    table = AttendanceSummary.__table__
+    # Another worker seeding at the same time writes the same rows
+    written = db.session.execute(
+        ignoring_insert(table, db.session.get_bind().dialect).from_select(SUMMARY_COLUMNS, summary_select())
+    ).rowcount
+    db.session.commit()
+    return written
+
+
+def refresh_for_records(pairs):
+    """Refresh the summaries touched by ``{"s_id", "st_id"}`` session/student pairs."""
+    if not pairs:
+        return
+    sessions = AttendanceSession.__table__
+    session_ids = {pair["s_id"] for pair in pairs}
+    refresh_summaries(
+        db.select(sessions.c.module_id).where(sessions.c.id.in_(session_ids)),
+        {pair["st_id"] for pair in pairs},
+    )
@@ -1,8 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, logout_user, login_required
 from flask_jwt_extended import create_access_token
 from .models import db, User, Lecturer, Faculty, Department, Student, Course, Module
+from .face_codec import pack_encoding, decode_encoding
+from .face_index import find_duplicate_face, get_face_gallery
+import json
 import random
 import string
 from datetime import timedelta
@@ -213,6 +216,20 @@ def api_student_register():
     if not full_name or not email or not password or not student_number or not faculty_name or not course_name:
         return jsonify({"msg": "Missing required fields"}), 400
 
+    # Normalize and pack the face encoding once, at write time
+    if face_encoding:
+        try:
+            if isinstance(face_encoding, str):
+                face_encoding = json.loads(face_encoding)
+            face_encoding = pack_encoding(face_encoding)
+        except (ValueError, TypeError) as e:
+            return jsonify({"msg": f"Invalid face encoding: {e}"}), 400
+        # A face the gallery cannot hold could never be verified
+        gallery = get_face_gallery()
+        size = decode_encoding(face_encoding).size
+        if gallery.size and size != gallery.dimension:
+            return jsonify({"msg": f"Invalid face encoding: expected {gallery.dimension} values, got {size}"}), 400
+
     # Check if email already exists
     if User.query.filter_by(email=email).first():
         return jsonify({"msg": "Email already registered"}), 409
@@ -229,6 +246,26 @@ def api_student_register():
     if not course:
         return jsonify({"msg": f"Course '{course_name}' not found in faculty '{faculty_name}'"}), 404
 
+    # Check the face is not already enrolled under another student number
+    duplicate = None
+    if face_encoding:
+        try:
+            duplicate, check_ms = find_duplicate_face(decode_encoding(face_encoding))
+        except ValueError as e:
+            return jsonify({"msg": f"Invalid face encoding: {e}"}), 400
+        # A stale gallery can still hold a student deleted by another worker
+        existing = Student.query.get(duplicate[0]) if duplicate else None
+        if existing is None:
+            duplicate = None
+        else:
+            print(f"Duplicate face for {student_number}: matches {existing.student_number} "
+                  f"(score {duplicate[1]:.3f}, {check_ms:.1f} ms)")
+            if current_app.config["FACE_DUPLICATE_POLICY"] == "reject":
+                return jsonify({
+                    "msg": "This face is already registered to another student",
+                    "duplicate_of": existing.student_number
+                }), 409
+
     # Create User
     hashed = generate_password_hash(password)
     user = User(
@@ -247,7 +284,8 @@ def api_student_register():
         faculty_id=faculty.id,
         course_id=course.id,
         module_id=module_id,
-        face_encoding=face_encoding
+        face_encoding=face_encoding,
+        face_duplicate_of=duplicate[0] if duplicate else None
     )
     db.session.add(student)
     db.session.commit()
@@ -255,12 +293,15 @@ def api_student_register():
    # Generate JWT token using user ID
     access_token = create_access_token(identity=user.id)
 
-    return jsonify({
+    response = {
         "msg": "Student registered successfully",
         "user_id": user.id,
         "full_name": user.full_name,
         "access_token": access_token
-    }), 201
+    }
+    if duplicate:
+        response["duplicate_of"] = existing.student_number
+    return jsonify(response), 201
 
 
 # ----------------------
@@ -0,0 +1,316 @@
+# app/face_ann.py
+import copy
+import time
+
+import numpy as np
+
+
+# ---------------------- Helpers ----------------------
+def top_k(scores, k):
+    """Indices of the ``k`` largest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=20, seed=0):
+    """
+    k-means on unit vectors using cosine similarity.
+    Returns an (n_clusters, dim) float32 matrix of unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+
+        # Re-seed empty clusters from random points instead of dropping them
+        empty = norms == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = (sums / norms[:, None]).astype(np.float32)
+
+    return centroids
+
+
+def synthetic_encodings(size, dim, rng, cluster_size=500, spread=0.6):
+    """
+    Random unit vectors grouped around ``size // cluster_size`` centres,
+    a rough stand-in for real face encodings (similar-looking cohorts).
+    """
+    centres = rng.normal(size=(max(1, size // cluster_size), dim)).astype(np.float32)
+    vectors = centres[rng.integers(len(centres), size=size)]
+    vectors = vectors + spread * rng.normal(size=(size, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def noisy_probes(vectors, noise, rng):
+    """Unit vectors near ``vectors``: what a scanner sees for an enrolled face."""
+    probes = vectors + noise * rng.normal(size=vectors.shape).astype(np.float32)
+    return probes / np.linalg.norm(probes, axis=1, keepdims=True)
+
+
+# ---------------------- IVF index ----------------------
+class IVFIndex:
+    """
+    Inverted-file index over a normalized gallery matrix.
+
+    A coarse quantizer (k-means centroids) splits the gallery into ``nlist``
+    lists. A search scores the centroids, scans only the ``nprobe`` closest
+    lists and re-ranks that shortlist exactly against the full vectors.
+
+    Rows added after ``build`` go to their nearest list's overflow until
+    the next ``remap`` folds them in; centroids are not retrained.
+
+    ``add`` and ``remap`` replace the list structures rather than change
+    them in place, so a ``copy`` taken earlier keeps answering for the
+    gallery rows it was published with.
+    """
+
+    TRAIN_POINTS_PER_LIST = 256
+
+    def __init__(self, nlist, nprobe=8, iterations=20, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        # Lists are stored CSR-style: rows of list i are order[offsets[i]:offsets[i + 1]]
+        self.order = None
+        self.offsets = None
+        self.extra = {}
+
+    def build(self, matrix):
+        """Train centroids on (a sample of) ``matrix`` and fill the lists."""
+        rng = np.random.default_rng(self.seed)
+        n_train = min(len(matrix), self.nlist * self.TRAIN_POINTS_PER_LIST)
+        sample = matrix[rng.choice(len(matrix), n_train, replace=False)]
+        self.centroids = spherical_kmeans(sample, self.nlist, self.iterations, self.seed)
+        self.nlist = len(self.centroids)
+
+        self._fill(self.assign(matrix))
+        return self
+
+    def _fill(self, assignment, rows=None):
+        """Lay out the CSR lists from a list id per row."""
+        rows = np.arange(len(assignment), dtype=np.int64) if rows is None else rows
+        order = np.argsort(assignment, kind="stable")
+        self.order = rows[order].astype(np.int64)
+        counts = np.bincount(assignment, minlength=self.nlist)
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.extra = {}
+
+    def add(self, row, vector):
+        """Put a newly appended gallery row into its nearest list."""
+        nearest = int(np.argmax(self.centroids @ vector))
+        extra = dict(self.extra)
+        extra[nearest] = extra.get(nearest, ()) + (row,)
+        self.extra = extra
+
+    def copy(self):
+        """A frozen view: later add/remap calls on this index do not reach it."""
+        return copy.copy(self)
+
+    def remap(self, mapping):
+        """
+        Renumber rows after the gallery is compacted. ``mapping[old_row]`` is
+        the new row, or -1 for rows that were dropped.
+        """
+        lists, rows = [], []
+        for i in range(self.nlist):
+            members = self.list_rows(i)
+            lists.append(np.full(len(members), i, dtype=np.int64))
+            rows.append(members)
+        assignment, rows = np.concatenate(lists), mapping[np.concatenate(rows)]
+        keep = rows >= 0
+        self._fill(assignment[keep], rows[keep])
+
+    def list_rows(self, i):
+        rows = self.order[self.offsets[i]:self.offsets[i + 1]]
+        if i in self.extra:
+            rows = np.concatenate((rows, np.asarray(self.extra[i], dtype=np.int64)))
+        return rows
+
+    def assign(self, matrix):
+        """Nearest centroid for every row of ``matrix``."""
+        assignment = np.empty(len(matrix), dtype=np.int64)
+        # Chunked so a large gallery never materializes an N x nlist matrix at once
+        for start in range(0, len(matrix), 65536):
+            chunk = matrix[start:start + 65536]
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignment
+
+    def candidates(self, query, nprobe=None):
+        """Gallery row indices in the ``nprobe`` lists closest to ``query``."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([self.list_rows(i) for i in lists])
+
+    def search(self, score_rows, query, k=1, nprobe=None, alive=None):
+        """
+        Return (row indices, scores) of the best ``k`` rows, best first.
+
+        ``score_rows(rows)`` scores the shortlist against the query, so the
+        same lists work over float32 or int8 gallery storage. ``alive``
+        optionally masks out deleted gallery rows.
+        """
+        rows = self.candidates(query, nprobe)
+        if alive is not None:
+            rows = rows[alive[rows]]
+        scores = score_rows(rows)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+
+# ---------------------- int8 quantization ----------------------
+def quantize_int8(vectors):
+    """
+    Symmetric per-row int8 quantization: ``row ~= codes * scale``.
+    Returns (int8 codes, float32 scales).
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes, scales):
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def int8_scores(codes, scales, queries, chunk_rows=65536):
+    """
+    Approximate cosine scores of ``queries`` (m x D floats) against int8
+    gallery rows, from integer dot products of the int8 codes.
+
+    The int8 x int8 sums stay below 2**24 for D <= 1040, so casting one
+    chunk of codes at a time to float32 lets BLAS compute the integer dot
+    products exactly without holding a float copy of the gallery.
+    """
+    query_codes, query_scales = quantize_int8(queries)
+    query_codes = query_codes.astype(np.float32)
+    scores = np.empty((len(query_codes), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), chunk_rows):
+        block = codes[start:start + chunk_rows].astype(np.float32)
+        scores[:, start:start + len(block)] = query_codes @ block.T
+    scores *= query_scales[:, None]
+    scores *= scales[None, :]
+    return scores
+
+
+# ---------------------- Duplicate detection ----------------------
+def iter_duplicate_pairs(matrix, ids, threshold, block_size=2048):
+    """
+    Yield every (id_a, id_b, score) pair of rows whose cosine similarity is
+    at least ``threshold``, with id_a's row before id_b's.
+
+    Works block by block over the upper triangle of ``matrix @ matrix.T``,
+    so memory stays at block_size x N floats and pairs stream out as soon
+    as their block is scored.
+    """
+    n = len(matrix)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        scores = matrix[start:stop] @ matrix[start:].T
+        # Inside the diagonal block only keep pairs above the diagonal
+        scores[:, :stop - start] = np.where(
+            np.triu(np.ones((stop - start, stop - start), dtype=bool), k=1),
+            scores[:, :stop - start],
+            -np.inf,
+        )
+        rows, cols = np.nonzero(scores >= threshold)
+        for r, c in zip(rows, cols):
+            yield int(ids[start + r]), int(ids[start + c]), float(scores[r, c])
+
+
+# ---------------------- Recall / latency reports ----------------------
+def recall_report(matrix, queries, k=1, nlist=None, nprobes=(1, 2, 4, 8, 16, 32), seed=0):
+    """
+    Compare IVF search against the exact scan for each probe count.
+
+    ``matrix`` and ``queries`` must already be normalized. Returns one dict
+    per setting with recall@k and mean/p95 latency in milliseconds.
+    """
+    nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+    build_start = time.perf_counter()
+    index = IVFIndex(nlist, seed=seed).build(matrix)
+    build_ms = (time.perf_counter() - build_start) * 1000
+
+    def timed(search):
+        results, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results.append(search(query))
+            latencies.append((time.perf_counter() - start) * 1000)
+        return results, np.asarray(latencies)
+
+    exact, exact_ms = timed(lambda q: top_k(matrix @ q, k))
+    report = [{
+        "mode": "exact",
+        "nprobe": None,
+        "recall": 1.0,
+        "mean_ms": round(float(exact_ms.mean()), 4),
+        "p95_ms": round(float(np.percentile(exact_ms, 95)), 4),
+    }]
+
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        approx, approx_ms = timed(lambda q: index.search(lambda rows: matrix[rows] @ q, q, k, nprobe)[0])
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+        report.append({
+            "mode": "ivf",
+            "nlist": index.nlist,
+            "nprobe": nprobe,
+            "recall": round(hits / (len(queries) * min(k, len(matrix))), 4),
+            "mean_ms": round(float(approx_ms.mean()), 4),
+            "p95_ms": round(float(np.percentile(approx_ms, 95)), 4),
+            "build_ms": round(build_ms, 1),
+        })
+    return report
+
+
+def quantization_report(matrix, queries, k=1, rerank_depths=(1, 8, 32, 128)):
+    """
+    Memory use and accuracy drift of int8 storage against exact float32
+    cosine scoring (what verify computes).
+    Shortlists are re-ranked the way FaceGallery does: float32 queries
+    against the dequantized rows.
+
+    ``matrix`` and ``queries`` must already be normalized.
+    """
+    codes, scales = quantize_int8(matrix)
+    exact_scores = queries @ matrix.T
+    approx_scores = int8_scores(codes, scales, queries)
+    rerank_scores = queries @ dequantize_int8(codes, scales).T
+    drift = np.abs(approx_scores - exact_scores)
+
+    exact_top = [top_k(row, k) for row in exact_scores]
+    report = {
+        "gallery_size": len(matrix),
+        "dim": matrix.shape[1],
+        "float32_bytes": int(matrix.nbytes),
+        "int8_bytes": int(codes.nbytes + scales.nbytes),
+        "score_drift_mean": round(float(drift.mean()), 6),
+        "score_drift_max": round(float(drift.max()), 6),
+        "rerank": [],
+    }
+    for depth in rerank_depths:
+        hits = 0
+        for row_approx, row_rerank, expected in zip(approx_scores, rerank_scores, exact_top):
+            shortlist = top_k(row_approx, max(depth, k))
+            final = shortlist[top_k(row_rerank[shortlist], k)]
+            hits += len(np.intersect1d(final, expected))
+        report["rerank"].append({
+            "depth": depth,
+            "recall": round(hits / (len(queries) * min(k, len(matrix))), 4),
+        })
+    return report
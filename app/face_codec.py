@@ -0,0 +1,81 @@
+# app/face_codec.py
+import json
+import struct
+
+import numpy as np
+
+# ------------------------------------------------------------
+# Binary face encoding format
+#
+#   offset 0  magic    2 bytes  b"FE"
+#   offset 2  version  uint8    (currently 1)
+#   offset 3  flags    uint8    bit 0 set = vector is L2-normalized
+#   offset 4  dim      uint32   little-endian
+#   offset 8  data     dim * float32, little-endian
+#
+# The 8-byte header keeps the float payload 4-byte aligned, so readers
+# can build a NumPy view straight over the stored bytes.
+# ------------------------------------------------------------
+MAGIC = b"FE"
+VERSION = 1
+FLAG_NORMALIZED = 0x01
+HEADER = struct.Struct("<2sBBI")
+FLOAT_DTYPE = np.dtype("<f4")
+
+
+def normalize_encoding(encoding):
+    """Return a raw face encoding as a flat float32 unit vector."""
+    vector = np.asarray(encoding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if vector.size == 0 or not np.isfinite(norm) or norm == 0:
+        raise ValueError("Face encoding is empty or has zero norm.")
+    return vector / norm
+
+
+def is_packed(stored):
+    """True if a stored value uses the binary format rather than JSON."""
+    return isinstance(stored, (bytes, bytearray, memoryview)) and bytes(stored[:2]) == MAGIC
+
+
+def pack_encoding(encoding):
+    """Normalize an encoding and serialize it to the binary format."""
+    vector = normalize_encoding(encoding).astype(FLOAT_DTYPE, copy=False)
+    header = HEADER.pack(MAGIC, VERSION, FLAG_NORMALIZED, vector.size)
+    return header + vector.tobytes()
+
+
+def unpack_encoding(blob):
+    """
+    Return ``(vector, normalized)`` for a binary encoding.
+
+    ``vector`` is a read-only NumPy view over ``blob``; no floats are copied.
+    """
+    if len(blob) < HEADER.size:
+        raise ValueError("Face encoding blob is truncated.")
+    magic, version, flags, dim = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Face encoding blob has an unknown header.")
+    if version != VERSION:
+        raise ValueError(f"Unsupported face encoding version {version}.")
+    if len(blob) != HEADER.size + dim * FLOAT_DTYPE.itemsize:
+        raise ValueError("Face encoding blob length does not match its header.")
+    vector = np.frombuffer(blob, dtype=FLOAT_DTYPE, count=dim, offset=HEADER.size)
+    return vector, bool(flags & FLAG_NORMALIZED)
+
+
+def decode_encoding(stored):
+    """
+    Read a Student.face_encoding value in either storage format and return
+    a float32 unit vector.
+    """
+    if is_packed(stored):
+        vector, normalized = unpack_encoding(stored)
+        return vector if normalized else normalize_encoding(vector)
+
+    # Legacy rows: a JSON list of floats, stored as text (or as bytes once
+    # the column has been converted to a BLOB).
+    if isinstance(stored, (bytes, bytearray, memoryview)):
+        stored = bytes(stored).decode("utf-8")
+    if isinstance(stored, str):
+        stored = json.loads(stored)
+    return normalize_encoding(stored)
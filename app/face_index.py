@@ -0,0 +1,622 @@
+# app/face_index.py
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import db, Student, FaceGalleryChange
+from .face_codec import decode_encoding, normalize_encoding
+from .face_ann import IVFIndex, top_k, quantize_int8, dequantize_int8, int8_scores
+from .face_shards import create_matcher
+
+
+# ---------------------- Gallery ----------------------
+# Everything a lookup needs, swapped as one object so readers never see a
+# half-built gallery while another thread changes it. ``matrix`` holds
+# float32 rows, or int8 codes when ``scales`` is set. ``alive`` is None
+# when there are no tombstones. ``scopes`` caches the gallery rows
+# belonging to each (module_id, course_id) roster; it is carried over to
+# the next snapshot until rows are renumbered (load or compaction).
+GallerySnapshot = namedtuple(
+    "GallerySnapshot", ["ids", "matrix", "scales", "module_ids", "course_ids", "alive", "ivf", "scopes"]
+)
+
+
+def empty_snapshot():
+    ids = np.empty(0, dtype=np.int64)
+    return GallerySnapshot(ids, np.empty((0, 0), dtype=np.float32), None, ids, ids, None, None, {})
+
+
+class FaceGallery:
+    """
+    Process-resident index of every enrolled face.
+
+    Holds one pre-normalized float32 matrix (one row per student) and a
+    parallel array of student ids, so a lookup is a single matrix-vector
+    product followed by a top-k selection.
+
+    With FACE_INDEX_MODE = "ivf" an IVFIndex is built over the same matrix
+    and lookups only scan the closest FACE_IVF_NPROBE lists.
+
+    With FACE_INDEX_STORAGE = "int8" each row is kept as int8 codes plus one
+    float32 scale (about a quarter of the memory). Candidates are scored
+    with integer dot products and the best FACE_INT8_RERANK_DEPTH are
+    re-scored with the float32 query against their dequantized rows.
+
+    With FACE_SHARDS > 1 (float32, exact mode, at least FACE_SHARD_MIN_SIZE
+    faces) full-gallery scans are fanned out to a pool of worker processes
+    that hold the gallery in shared memory; see app.face_shards.
+
+    The gallery is loaded from the database once and then kept current in
+    place: new encodings are appended to over-allocated arrays, removed ones
+    are tombstoned, and the arrays are compacted once tombstones pass
+    COMPACT_RATIO of the rows.
+    """
+
+    BATCH_SCORE_LIMIT = 16 * 1024 * 1024
+    COMPACT_RATIO = 0.25
+    SCOPE_CACHE_LIMIT = 1024
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot = empty_snapshot()
+        self.loaded = False
+        # Highest FaceGalleryChange id reflected in the gallery, plus the ids
+        # above it that this worker already applied on commit
+        self.version = 0
+        self._applied = set()
+        self._last_sync = 0.0
+        self.storage = "float32"
+        self.rerank_depth = 0
+        self.shard_count = 0
+        self.shard_min_size = 0
+        self._shards = None
+        self._reset_storage(0, 0)
+
+    @property
+    def size(self):
+        return len(self._row_of)
+
+    @property
+    def dimension(self):
+        return self._snapshot.matrix.shape[1]
+
+    @property
+    def matrix(self):
+        """Live gallery rows as float32 (tombstoned rows excluded)."""
+        snapshot = self._snapshot
+        matrix = snapshot.matrix
+        if snapshot.scales is not None:
+            matrix = dequantize_int8(matrix, snapshot.scales)
+        return matrix if snapshot.alive is None else matrix[snapshot.alive]
+
+    @property
+    def ids(self):
+        """Student ids of the live gallery rows, parallel to ``matrix``."""
+        snapshot = self._snapshot
+        return snapshot.ids if snapshot.alive is None else snapshot.ids[snapshot.alive]
+
+    # ---------------------- Storage ----------------------
+    def stats(self):
+        """Size and memory footprint of the gallery arrays."""
+        arrays = [self._ids, self._vectors, self._module_ids, self._course_ids, self._alive]
+        if self._scales is not None:
+            arrays.append(self._scales)
+        return {
+            "size": self.size,
+            "dimension": self._vectors.shape[1],
+            "storage": self.storage,
+            "capacity": len(self._ids),
+            "tombstones": self._tombstones,
+            "memory_bytes": int(sum(a.nbytes for a in arrays)),
+            "ivf_lists": self._ivf.nlist if self._ivf is not None else None,
+            "shards": [shard.live for shard in self._shards.shards] if self._shards else None,
+            "version": self.version,
+        }
+
+    def _reset_storage(self, capacity, dimension):
+        quantized = self.storage == "int8"
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._vectors = np.zeros((capacity, dimension), dtype=np.int8 if quantized else np.float32)
+        self._scales = np.ones(capacity, dtype=np.float32) if quantized else None
+        self._module_ids = np.full(capacity, -1, dtype=np.int64)
+        self._course_ids = np.full(capacity, -1, dtype=np.int64)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._count = 0
+        self._tombstones = 0
+        self._row_of = {}
+        self._ivf = None
+        self._renumbered = True
+
+    def _grow(self):
+        """Double the capacity so appends stay O(1) amortized."""
+        capacity = max(64, 2 * len(self._ids))
+        for name, fill in (("_ids", -1), ("_module_ids", -1), ("_course_ids", -1), ("_alive", False)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+        vectors = np.zeros((capacity, self._vectors.shape[1]), dtype=self._vectors.dtype)
+        vectors[:self._count] = self._vectors[:self._count]
+        self._vectors = vectors
+        if self._scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self._count] = self._scales[:self._count]
+            self._scales = scales
+
+    def _carry_scopes(self, previous, n):
+        """
+        The roster caches of ``previous`` brought up to date: rows appended
+        since are added, tombstoned ones dropped. Row numbers only stay valid
+        until the arrays are rebuilt or compacted, so then start empty.
+        """
+        if self._renumbered:
+            return {}
+        start = len(previous.ids)
+        module_ids, course_ids = self._module_ids[start:n], self._course_ids[start:n]
+        scopes = {}
+        # Readers may add keys meanwhile; list() takes its copy in one step
+        for (module_id, course_id), rows in list(previous.scopes.items())[-self.SCOPE_CACHE_LIMIT:]:
+            if n > start:
+                appended = np.flatnonzero((module_ids == module_id) | (course_ids == course_id))
+                rows = np.concatenate([rows, start + appended])
+            if self._tombstones:
+                rows = rows[self._alive[rows]]
+            scopes[(module_id, course_id)] = rows
+        return scopes
+
+    def _publish(self):
+        n = self._count
+        scopes = self._carry_scopes(self._snapshot, n)
+        self._renumbered = False
+        self._snapshot = GallerySnapshot(
+            self._ids[:n],
+            self._vectors[:n],
+            self._scales[:n] if self._scales is not None else None,
+            self._module_ids[:n],
+            self._course_ids[:n],
+            self._alive[:n] if self._tombstones else None,
+            # Its own copy: the writer keeps adding rows this snapshot does not have
+            self._ivf.copy() if self._ivf is not None else None,
+            scopes,
+        )
+
+    def load(self):
+        """(Re)build the gallery from every student with a face encoding."""
+        with self._lock:
+            self.storage = current_app.config["FACE_INDEX_STORAGE"]
+            self.rerank_depth = current_app.config["FACE_INT8_RERANK_DEPTH"]
+            self.shard_count = current_app.config["FACE_SHARDS"]
+            self.shard_min_size = current_app.config["FACE_SHARD_MIN_SIZE"]
+
+            # Read the version first: changes committed while we load are replayed
+            version = db.session.query(db.func.max(FaceGalleryChange.id)).scalar() or 0
+            rows = (
+                db.session.query(Student.id, Student.module_id, Student.course_id, Student.face_encoding)
+                .filter(Student.face_encoding.isnot(None))
+                .all()
+            )
+
+            ids, module_ids, course_ids, vectors = [], [], [], []
+            dimension = None
+            for student_id, module_id, course_id, stored in rows:
+                try:
+                    vector = decode_encoding(stored)
+                except (ValueError, TypeError, UnicodeDecodeError) as e:
+                    print(f"Skipping face encoding for student {student_id}: {e}")
+                    continue
+                if dimension is None:
+                    dimension = vector.size
+                elif vector.size != dimension:
+                    print(f"Skipping face encoding for student {student_id}: "
+                          f"expected {dimension} values, got {vector.size}")
+                    continue
+                ids.append(student_id)
+                # -1 never matches a real module/course id
+                module_ids.append(module_id or -1)
+                course_ids.append(course_id or -1)
+                vectors.append(vector)
+
+            self._reset_storage(len(ids), dimension or 0)
+            if ids:
+                self._ids[:] = ids
+                # Fill in chunks so int8 mode never holds a full float32 copy
+                for start in range(0, len(vectors), 65536):
+                    self._set_rows(slice(start, start + 65536), np.vstack(vectors[start:start + 65536]))
+                self._module_ids[:] = module_ids
+                self._course_ids[:] = course_ids
+                self._alive[:] = True
+                self._count = len(ids)
+                self._row_of = {student_id: row for row, student_id in enumerate(ids)}
+            self._ivf = self._build_ivf(self._float_rows())
+            self._build_shards()
+            self._publish()
+
+            self.version = version
+            self._last_sync = time.monotonic()
+            self.loaded = True
+            print(f"Face gallery loaded: {len(ids)} {self.storage} encodings (version {version})")
+
+    def _set_rows(self, rows, vectors):
+        if self._scales is None:
+            self._vectors[rows] = vectors
+        else:
+            self._vectors[rows], self._scales[rows] = quantize_int8(vectors)
+
+    def _float_rows(self):
+        """Stored rows as float32 (dequantized in int8 mode)."""
+        vectors = self._vectors[:self._count]
+        if self._scales is None:
+            return vectors
+        return dequantize_int8(vectors, self._scales[:self._count])
+
+    def _build_ivf(self, matrix):
+        """Build the ANN index when configured and the gallery is big enough."""
+        config = current_app.config
+        if config["FACE_INDEX_MODE"] != "ivf" or len(matrix) < max(1, config["FACE_IVF_MIN_SIZE"]):
+            return None
+        nlist = config["FACE_IVF_NLIST"] or max(1, int(np.sqrt(len(matrix))))
+        return IVFIndex(nlist, nprobe=config["FACE_IVF_NPROBE"]).build(matrix)
+
+    def _build_shards(self):
+        """(Re)partition the live rows across the worker pool, or stop sharding."""
+        wanted = (
+            self.shard_count > 1 and self.storage == "float32" and self._ivf is None
+            and self.size >= max(1, self.shard_min_size)
+        )
+        if not wanted:
+            if self._shards is not None:
+                self._shards.close()
+                self._shards = None
+            return
+        alive = np.flatnonzero(self._alive[:self._count])
+        if self._shards is None or self._shards.n_shards != self.shard_count:
+            if self._shards is not None:
+                self._shards.close()
+            self._shards = create_matcher(self.shard_count, self._ids[alive], self._vectors[alive])
+        else:
+            self._shards.build(self._ids[alive], self._vectors[alive])
+
+    def invalidate(self):
+        """Mark the gallery stale so the next lookup rebuilds it."""
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+
+    # ---------------------- Incremental maintenance ----------------------
+    def _remove(self, student_id):
+        row = self._row_of.pop(student_id, None)
+        if row is None:
+            return
+        self._alive[row] = False
+        self._ids[row] = -1
+        self._tombstones += 1
+        if self._shards is not None:
+            self._shards.remove(student_id)
+
+    def _upsert(self, student_id, stored, module_id, course_id):
+        try:
+            vector = decode_encoding(stored)
+        except (ValueError, TypeError, UnicodeDecodeError) as e:
+            print(f"Dropping face encoding for student {student_id}: {e}")
+            self._remove(student_id)
+            return
+        if self._count and vector.size != self._vectors.shape[1]:
+            print(f"Dropping face encoding for student {student_id}: "
+                  f"expected {self._vectors.shape[1]} values, got {vector.size}")
+            self._remove(student_id)
+            return
+        if not self._count and vector.size != self._vectors.shape[1]:
+            self._reset_storage(0, vector.size)
+            if self._shards is not None:
+                self._shards.build(self._ids, self._vectors)
+
+        # An update is a tombstone plus an append, so the IVF lists and any
+        # roster caches never hold a row whose vector changed underneath them.
+        self._remove(student_id)
+        if self._count == len(self._ids):
+            self._grow()
+        row = self._count
+        self._ids[row] = student_id
+        self._set_rows(slice(row, row + 1), vector[None, :])
+        self._module_ids[row] = module_id or -1
+        self._course_ids[row] = course_id or -1
+        self._alive[row] = True
+        self._row_of[student_id] = row
+        self._count += 1
+        if self._ivf is not None:
+            self._ivf.add(row, vector)
+        if self._shards is not None:
+            self._shards.add(student_id, vector)
+
+    def _compact(self):
+        """Drop tombstoned rows and renumber the survivors."""
+        keep = np.flatnonzero(self._alive[:self._count])
+        mapping = np.full(self._count, -1, dtype=np.int64)
+        mapping[keep] = np.arange(len(keep))
+
+        self._ids = self._ids[keep]
+        self._vectors = self._vectors[keep]
+        if self._scales is not None:
+            self._scales = self._scales[keep]
+        self._module_ids = self._module_ids[keep]
+        self._course_ids = self._course_ids[keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._count = len(keep)
+        self._tombstones = 0
+        self._row_of = {int(student_id): row for row, student_id in enumerate(self._ids)}
+        self._renumbered = True
+        if self._ivf is not None:
+            self._ivf.remap(mapping)
+        print(f"Face gallery compacted: {len(keep)} live rows")
+
+    def apply(self, changes, log_ids=()):
+        """
+        Apply committed changes in place. ``changes`` maps student_id to
+        ``(face_encoding, module_id, course_id)``, or to None for a removal.
+        ``log_ids`` are the FaceGalleryChange rows written for them, which
+        sync() will then skip.
+        """
+        if not self.loaded or not changes:
+            return
+        with self._lock:
+            self._applied.update(log_ids)
+            for student_id, change in changes.items():
+                if change is None or change[0] is None:
+                    self._remove(student_id)
+                else:
+                    self._upsert(student_id, *change)
+            if self._tombstones > self.COMPACT_RATIO * max(self._count, 1):
+                self._compact()
+            if self._shards is None and self.shard_count > 1 and self.size >= max(1, self.shard_min_size):
+                self._build_shards()
+            self._publish()
+
+    def sync(self):
+        """
+        Catch up with changes committed by other workers.
+
+        Costs one MAX(id) query when nothing changed; otherwise re-reads only
+        the students named in newer FaceGalleryChange rows.
+        """
+        with self._lock:
+            latest = db.session.query(db.func.max(FaceGalleryChange.id)).scalar() or 0
+            self._last_sync = time.monotonic()
+            if latest <= self.version:
+                return
+
+            changed = {
+                student_id for log_id, student_id in
+                db.session.query(FaceGalleryChange.id, FaceGalleryChange.student_id)
+                .filter(FaceGalleryChange.id > self.version, FaceGalleryChange.id <= latest)
+                if log_id not in self._applied
+            }
+            self._applied = {log_id for log_id in self._applied if log_id > latest}
+            self.version = latest
+            if not changed:
+                return
+
+            rows = (
+                db.session.query(Student.id, Student.face_encoding, Student.module_id, Student.course_id)
+                .filter(Student.id.in_(changed))
+                .all()
+            )
+            changes = dict.fromkeys(changed)
+            changes.update({row.id: tuple(row[1:]) for row in rows})
+            self.apply(changes)
+
+    def maybe_sync(self):
+        interval = current_app.config["FACE_INDEX_SYNC_INTERVAL"]
+        if interval >= 0 and time.monotonic() - self._last_sync >= interval:
+            self.sync()
+
+    # ---------------------- Lookups ----------------------
+    def scope_rows(self, module_id, course_id, snapshot=None):
+        """
+        Gallery rows of students enrolled in a module, either directly
+        (Student.module_id) or through the module's course (Student.course_id).
+        """
+        snapshot = snapshot or self._snapshot
+        key = (module_id, course_id)
+        rows = snapshot.scopes.get(key)
+        if rows is None:
+            mask = (snapshot.module_ids == module_id) | (snapshot.course_ids == course_id)
+            if snapshot.alive is not None:
+                mask &= snapshot.alive
+            rows = np.flatnonzero(mask)
+            snapshot.scopes[key] = rows
+        return rows
+
+    def _score(self, snapshot, queries, rows=None):
+        """Scores of ``queries`` (m x D) against gallery ``rows`` (default: all)."""
+        vectors = snapshot.matrix if rows is None else snapshot.matrix[rows]
+        if snapshot.scales is None:
+            return queries @ vectors.T
+        scales = snapshot.scales if rows is None else snapshot.scales[rows]
+        return int8_scores(vectors, scales, queries)
+
+    def _prepare(self, encoding, snapshot):
+        query = normalize_encoding(encoding)
+        if query.size != snapshot.matrix.shape[1]:
+            raise ValueError(
+                f"Face encoding must have {snapshot.matrix.shape[1]} values, got {query.size}."
+            )
+        return query
+
+    def _search(self, snapshot, queries, k, module_id=None, course_id=None):
+        """Top-k (student_id, score) lists for each row of ``queries``."""
+        quantized = snapshot.scales is not None
+        depth = max(k, self.rerank_depth) if quantized else k
+        scoped = module_id is not None or course_id is not None
+        hits = []
+
+        if not scoped and snapshot.ivf is None and not quantized and self._shards is not None:
+            # The matcher is kept current in place, so it answers in student ids
+            return self._shards.search(queries, k)
+
+        if not scoped and snapshot.ivf is not None:
+            for query in queries:
+                hits.append(snapshot.ivf.search(
+                    lambda rows: self._score(snapshot, query[None, :], rows)[0],
+                    query, depth, alive=snapshot.alive
+                ))
+        else:
+            # Rosters are small, so scoped lookups are always exact scans
+            candidates = self.scope_rows(module_id, course_id, snapshot) if scoped else None
+            width = len(candidates) if scoped else len(snapshot.ids)
+            # Chunk the queries so the score matrix stays around BATCH_SCORE_LIMIT floats
+            chunk = max(1, self.BATCH_SCORE_LIMIT // max(1, width))
+            for start in range(0, len(queries), chunk):
+                scores = self._score(snapshot, queries[start:start + chunk], candidates)
+                if not scoped and snapshot.alive is not None:
+                    scores[:, ~snapshot.alive] = -np.inf
+                for row_scores in scores:
+                    best = top_k(row_scores, depth)
+                    hits.append((candidates[best] if scoped else best, row_scores[best]))
+
+        if quantized:
+            hits = [self._rerank(snapshot, rows, query, k) for (rows, _), query in zip(hits, queries)]
+        ids = snapshot.ids
+        return [
+            [(int(ids[r]), float(score)) for r, score in zip(rows, scores) if ids[r] >= 0]
+            for rows, scores in hits
+        ]
+
+    def _rerank(self, snapshot, rows, query, k):
+        """
+        Re-score an int8 shortlist with the float32 query against the
+        dequantized rows. Only the gallery side keeps its rounding error,
+        and nothing leaves memory.
+        """
+        rows = rows[snapshot.ids[rows] >= 0]
+        scores = dequantize_int8(snapshot.matrix[rows], snapshot.scales[rows]) @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def search(self, encoding, k=1, module_id=None, course_id=None):
+        """
+        Return up to ``k`` (student_id, cosine similarity) pairs for an
+        incoming encoding, best match first.
+
+        When ``module_id``/``course_id`` are given only that module's roster
+        is searched.
+        """
+        snapshot = self._snapshot
+        if not self.size:
+            return []
+        query = self._prepare(encoding, snapshot)
+        return self._search(snapshot, query[None, :], k, module_id, course_id)[0]
+
+    def search_batch(self, encodings, k=1, module_id=None, course_id=None):
+        """
+        Search many encodings at once with one matrix-matrix product.
+
+        Returns one entry per encoding: a list of (student_id, score) pairs,
+        or the ValueError raised for that encoding, so one bad item does not
+        fail the whole batch.
+        """
+        snapshot = self._snapshot
+        results = [[] for _ in encodings]
+        if not self.size:
+            return results
+
+        valid, queries = [], []
+        for i, encoding in enumerate(encodings):
+            try:
+                queries.append(self._prepare(encoding, snapshot))
+            except (ValueError, TypeError) as e:
+                results[i] = ValueError(str(e))
+                continue
+            valid.append(i)
+        if queries:
+            found = self._search(snapshot, np.vstack(queries), k, module_id, course_id)
+            for i, matches in zip(valid, found):
+                results[i] = matches
+        return results
+
+face_gallery = FaceGallery()
+
+
+def get_face_gallery():
+    """Return the process-wide gallery, loading it on first use."""
+    face_gallery.ensure_loaded()
+    face_gallery.maybe_sync()
+    return face_gallery
+
+
+def find_duplicate_face(encoding):
+    """
+    Look for an already enrolled face within FACE_DUPLICATE_TOLERANCE.
+
+    Returns ``((student_id, score) or None, elapsed_ms)``. Checks that take
+    longer than FACE_DUPLICATE_BUDGET_MS are logged so the budget can be
+    tuned (or FACE_INDEX_MODE switched to "ivf").
+    """
+    start = time.perf_counter()
+    matches = get_face_gallery().search(encoding, k=1)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    budget_ms = current_app.config["FACE_DUPLICATE_BUDGET_MS"]
+    if elapsed_ms > budget_ms:
+        print(f"Duplicate face check took {elapsed_ms:.1f} ms (budget {budget_ms} ms)")
+
+    threshold = 1 - current_app.config["FACE_DUPLICATE_TOLERANCE"]
+    if matches and matches[0][1] >= threshold:
+        return matches[0], elapsed_ms
+    return None, elapsed_ms
+
+
+# ---------------------- Session hooks ----------------------
+# Student changes are collected at flush time, logged to face_gallery_changes
+# in the same transaction, and applied to this worker's gallery only once
+# the transaction commits. Other workers pick them up through sync().
+PENDING_KEY = "face_gallery_changes"
+PENDING_LOG_KEY = "face_gallery_change_ids"
+WATCHED_ATTRS = ("face_encoding", "module_id", "course_id")
+
+
+@event.listens_for(Session, "after_flush")
+def collect_face_changes(session, flush_context):
+    changes = {}
+    for obj in session.new:
+        if isinstance(obj, Student) and obj.face_encoding is not None:
+            changes[obj.id] = (obj.face_encoding, obj.module_id, obj.course_id)
+    for obj in session.dirty:
+        if isinstance(obj, Student):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in WATCHED_ATTRS):
+                changes[obj.id] = (obj.face_encoding, obj.module_id, obj.course_id)
+    for obj in session.deleted:
+        if isinstance(obj, Student):
+            changes[obj.id] = None
+
+    if changes:
+        # One insert per student (usually just one) so we learn the log ids
+        connection = session.connection()
+        log_ids = session.info.setdefault(PENDING_LOG_KEY, [])
+        for student_id in changes:
+            result = connection.execute(FaceGalleryChange.__table__.insert().values(student_id=student_id))
+            log_ids.append(result.inserted_primary_key[0])
+        session.info.setdefault(PENDING_KEY, {}).update(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def apply_face_changes(session):
+    changes = session.info.pop(PENDING_KEY, None)
+    log_ids = session.info.pop(PENDING_LOG_KEY, ())
+    if changes:
+        face_gallery.apply(changes, log_ids)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_face_changes(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+    session.info.pop(PENDING_LOG_KEY, None)
@@ -0,0 +1,307 @@
+# app/face_shards.py
+import atexit
+import multiprocessing
+import sys
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .face_ann import top_k
+
+
+# ------------------------------------------------------------
+# Shared memory layout of one shard
+#
+#   int64[2]                header: live row count, capacity
+#   int64[capacity]         student ids (-1 = removed)
+#   float32[capacity, dim]  normalized face encodings
+#
+# The parent process owns every block and is the only writer; pool
+# workers attach read-only by name. A row is fully written before the
+# count in the header is bumped, so workers never score half a row.
+# ------------------------------------------------------------
+def shard_views(buffer, capacity, dim):
+    header = np.ndarray((2,), dtype=np.int64, buffer=buffer)
+    ids = np.ndarray((capacity,), dtype=np.int64, buffer=buffer, offset=16)
+    vectors = np.ndarray((capacity, dim), dtype=np.float32, buffer=buffer, offset=16 + 8 * capacity)
+    return header, ids, vectors
+
+
+def shard_bytes(capacity, dim):
+    return 16 + 8 * capacity + 4 * capacity * dim
+
+
+# ---------------------- Pool worker side ----------------------
+_attached = {}
+_attached_generation = None
+
+
+def _attach(name, generation):
+    """Attach to a shard block, dropping blocks from older generations."""
+    global _attached_generation
+    if generation != _attached_generation:
+        for block in _attached.values():
+            block.close()
+        _attached.clear()
+        _attached_generation = generation
+    block = _attached.get(name)
+    if block is None:
+        # Spawned workers share the parent's resource tracker, so attaching
+        # here does not add a second owner; the parent unlinks the block.
+        block = shared_memory.SharedMemory(name=name)
+        _attached[name] = block
+    return block
+
+
+def wait_for_peers(barrier):
+    """Pool initializer: hold each worker until all of them have been spawned."""
+    try:
+        barrier.wait(timeout=60)
+    except threading.BrokenBarrierError:
+        pass
+
+
+def warm_up(_):
+    return True
+
+
+def search_shard(name, generation, capacity, dim, queries, k):
+    """Top-k (student ids, scores) of ``queries`` within one shard."""
+    block = _attach(name, generation)
+    header, ids, vectors = shard_views(block.buf, capacity, dim)
+    count = int(header[0])
+    shard_ids = ids[:count].copy()
+    scores = queries @ vectors[:count].T
+    scores[:, shard_ids < 0] = -np.inf
+
+    k = min(k, count)
+    found_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    found_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    for i, row_scores in enumerate(scores):
+        best = top_k(row_scores, k)
+        found_ids[i, :len(best)] = shard_ids[best]
+        found_scores[i, :len(best)] = row_scores[best]
+    return found_ids, found_scores
+
+
+# ---------------------- Parent side ----------------------
+@contextmanager
+def worker_main():
+    """
+    Spawned workers re-import the parent's __main__ module. When that is a
+    server script that builds the app at import time (run.py), every
+    worker would run create_app()/db.create_all(). Point __main__ at this
+    module while the workers start, so they import nothing but it.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class Shard:
+    """One shared memory block plus the parent's id -> row map for it."""
+
+    HEADROOM = 1.5
+
+    def __init__(self, ids, vectors, dim, generation):
+        self.capacity = max(64, int(len(ids) * self.HEADROOM))
+        self.dim = dim
+        self.block = shared_memory.SharedMemory(
+            name=f"face_shard_{generation}_{uuid.uuid4().hex[:12]}",
+            create=True,
+            size=shard_bytes(self.capacity, dim),
+        )
+        self.header, self.ids, self.vectors = shard_views(self.block.buf, self.capacity, dim)
+        self.ids[:len(ids)] = ids
+        self.vectors[:len(ids)] = vectors
+        self.header[:] = (len(ids), self.capacity)
+        self.row_of = {int(student_id): row for row, student_id in enumerate(ids)}
+        self.tombstones = 0
+
+    @property
+    def count(self):
+        return int(self.header[0])
+
+    @property
+    def live(self):
+        return len(self.row_of)
+
+    def live_rows(self):
+        rows = np.flatnonzero(self.ids[:self.count] >= 0)
+        return self.ids[rows].copy(), self.vectors[rows].copy()
+
+    def append(self, student_id, vector):
+        """Returns False when the block is full."""
+        row = self.count
+        if row == self.capacity:
+            return False
+        self.ids[row] = student_id
+        self.vectors[row] = vector
+        self.header[0] = row + 1
+        self.row_of[student_id] = row
+        return True
+
+    def remove(self, student_id):
+        row = self.row_of.pop(student_id, None)
+        if row is not None:
+            self.ids[row] = -1
+            self.tombstones += 1
+
+    def release(self):
+        self.header = self.ids = self.vectors = None
+        self.block.close()
+        self.block.unlink()
+
+
+class ShardedMatcher:
+    """
+    Exact gallery search spread over a pool of worker processes.
+
+    The gallery is partitioned round-robin into ``n_shards`` shared memory
+    blocks; a query is fanned out to every shard and the per-shard top-k
+    lists are merged. New faces go to the least-filled shard. When a shard
+    runs out of headroom, or removals leave the shards unbalanced, all
+    shards are rebuilt with an even split (rebalanced).
+
+    A search only holds the lock while it submits its jobs. It pins the
+    generation of blocks it read, and blocks replaced by a rebalance are
+    released once the last search pinning them is done, so concurrent
+    requests search in parallel.
+    """
+
+    IMBALANCE = 1.5
+
+    def __init__(self, n_shards):
+        self.n_shards = n_shards
+        self.generation = 0
+        self.shards = []
+        self.dim = 0
+        self._lock = threading.RLock()
+        self._pool = None
+        self._readers = {}  # generation -> searches still reading its blocks
+        self._retired = {}  # generation -> replaced shards waiting for those searches
+
+    def build(self, ids, vectors):
+        with self._lock:
+            self.dim = vectors.shape[1] if vectors.ndim == 2 else 0
+            self._repartition(np.asarray(ids, dtype=np.int64), vectors)
+            if self._pool is None:
+                # spawn: never fork a process that is running Flask threads
+                context = multiprocessing.get_context("spawn")
+                with worker_main():
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.n_shards, mp_context=context,
+                        initializer=wait_for_peers, initargs=(context.Barrier(self.n_shards),),
+                    )
+                    # Start every worker now (and while __main__ is swapped)
+                    # rather than on the first lookup
+                    list(self._pool.map(warm_up, range(self.n_shards)))
+        return self
+
+    def _repartition(self, ids, vectors):
+        old, old_generation = self.shards, self.generation
+        self.generation += 1
+        self.shards = [
+            Shard(ids[i::self.n_shards], vectors[i::self.n_shards], self.dim, self.generation)
+            for i in range(self.n_shards)
+        ]
+        if self._readers.get(old_generation):
+            self._retired[old_generation] = old
+        else:
+            for shard in old:
+                shard.release()
+
+    def rebalance(self):
+        with self._lock:
+            parts = [shard.live_rows() for shard in self.shards]
+            ids = np.concatenate([p[0] for p in parts])
+            vectors = np.concatenate([p[1] for p in parts]) if len(ids) else np.empty((0, self.dim), np.float32)
+            self._repartition(ids, vectors)
+            print(f"Face shards rebalanced: {len(ids)} rows over {self.n_shards} shards")
+
+    def _unbalanced(self):
+        sizes = [shard.live for shard in self.shards]
+        return max(sizes) > self.IMBALANCE * min(sizes) + 1024
+
+    def add(self, student_id, vector):
+        with self._lock:
+            self.remove(student_id)
+            target = min(self.shards, key=lambda shard: shard.count)
+            if not target.append(student_id, vector):
+                self.rebalance()
+                min(self.shards, key=lambda shard: shard.count).append(student_id, vector)
+
+    def remove(self, student_id):
+        with self._lock:
+            for shard in self.shards:
+                shard.remove(student_id)
+            if self._unbalanced():
+                self.rebalance()
+
+    def search(self, queries, k):
+        """
+        Top-k (student_id, score) lists for each row of ``queries``,
+        merged across shards.
+        """
+        with self._lock:
+            generation = self.generation
+            self._readers[generation] = self._readers.get(generation, 0) + 1
+            jobs = [
+                self._pool.submit(
+                    search_shard, shard.block.name, generation, shard.capacity, self.dim, queries, k
+                )
+                for shard in self.shards
+            ]
+        try:
+            parts = [job.result() for job in jobs]
+        finally:
+            # Blocks replaced meanwhile stay mapped until no search reads them
+            with self._lock:
+                self._readers[generation] -= 1
+                if not self._readers[generation]:
+                    del self._readers[generation]
+                    for shard in self._retired.pop(generation, ()):
+                        shard.release()
+
+        ids = np.concatenate([p[0] for p in parts], axis=1)
+        scores = np.concatenate([p[1] for p in parts], axis=1)
+        results = []
+        for row_ids, row_scores in zip(ids, scores):
+            best = top_k(row_scores, k)
+            results.append([(int(row_ids[i]), float(row_scores[i])) for i in best if row_ids[i] >= 0])
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+            for shard in self.shards:
+                shard.release()
+            for shards in self._retired.values():
+                for shard in shards:
+                    shard.release()
+            self.shards = []
+            self._retired = {}
+
+
+_matchers = []
+
+
+def create_matcher(n_shards, ids, vectors):
+    matcher = ShardedMatcher(n_shards).build(ids, vectors)
+    _matchers.append(matcher)
+    return matcher
+
+
+@atexit.register
+def _close_matchers():
+    for matcher in _matchers:
+        matcher.close()
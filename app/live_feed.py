@@ -0,0 +1,162 @@
+# app/live_feed.py
+import json
+import threading
+import time
+from datetime import timedelta
+
+from .models import db, AttendanceRecord, Student, User
+
+
+class Channel:
+    """Every record change of one session seen so far, in the order it was seen."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.events = []  # (record_id, payload)
+        self.status = {}  # record_id -> last status sent
+        self.cursor = None  # latest changed_at seen
+        self.watchers = 0
+        self.idle_since = time.monotonic()
+        self.ready = False
+
+
+class LiveFeed:
+    """
+    In-process fan-out hub behind /attendance/api/session/<id>/stream.
+
+    One background thread polls attendance_records for every session that
+    somebody is watching. It uses one query per tick however many
+    sessions and watchers there are, and appends new rows to each
+    session's channel. Watchers only wait on a condition and read from
+    memory, so N dashboards on one session cost what one does.
+
+    Polls follow each record's changed_at, not its id: buffered, offline
+    and absence writes commit ids out of order, and an absent record
+    turned present keeps its id. A row becomes visible at COMMIT but is
+    stamped when written, and workers' clocks differ a little, so each
+    poll re-reads the last WINDOW as well and drops rows whose status
+    was already sent.
+    """
+
+    WINDOW = timedelta(seconds=30)
+    IDLE_TTL = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._channels = {}
+        self._thread = None
+        self.app = None
+
+    # ---------------------- Watchers ----------------------
+    def subscribe(self, app, session_id):
+        with self._lock:
+            self.app = app
+            channel = self._channels.get(session_id)
+            if channel is None:
+                channel = self._channels[session_id] = Channel(session_id)
+            channel.watchers += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="attendance-live-feed", daemon=True)
+                self._thread.start()
+            self._changed.notify_all()
+        return channel
+
+    def unsubscribe(self, channel):
+        with self._lock:
+            channel.watchers -= 1
+            if not channel.watchers:
+                channel.idle_since = time.monotonic()
+
+    def wait(self, channel, position, timeout):
+        """Events of ``channel`` after index ``position``; blocks up to ``timeout``."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while position >= len(channel.events):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._changed.wait(remaining)
+            return channel.events[position:]
+
+    def start_position(self, channel, after_id, timeout=10):
+        """
+        Index of the first event after the last one for record ``after_id``,
+        else of the first event for a newer record id.
+        """
+        with self._lock:
+            deadline = time.monotonic() + timeout
+            while not channel.ready and time.monotonic() < deadline:
+                self._changed.wait(deadline - time.monotonic())
+            for position in range(len(channel.events) - 1, -1, -1):
+                if channel.events[position][0] == after_id:
+                    return position + 1
+            for position, (record_id, _) in enumerate(channel.events):
+                if record_id > after_id:
+                    return position
+            return len(channel.events)
+
+    # ---------------------- Poller ----------------------
+    def _run(self):
+        with self.app.app_context():
+            interval = self.app.config["ATTENDANCE_FEED_POLL_INTERVAL"]
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    for session_id, channel in list(self._channels.items()):
+                        if not channel.watchers and now - channel.idle_since > self.IDLE_TTL:
+                            del self._channels[session_id]
+                    if not self._channels:
+                        self._thread = None
+                        return
+                    channels = dict(self._channels)
+                try:
+                    self._poll(channels)
+                except Exception as e:
+                    print(f"❌ Live feed poll failed: {e}")
+                finally:
+                    db.session.remove()
+                time.sleep(interval)
+
+    def _poll(self, channels):
+        # Each session from its own cursor (all of it the first time), in one query
+        newer = []
+        for session_id, channel in channels.items():
+            condition = AttendanceRecord.session_id == session_id
+            if channel.ready and channel.cursor is not None:
+                condition = db.and_(condition, AttendanceRecord.changed_at >= channel.cursor - self.WINDOW)
+            newer.append(condition)
+        rows = (
+            db.session.query(
+                AttendanceRecord.id, AttendanceRecord.session_id, AttendanceRecord.student_id,
+                AttendanceRecord.status, AttendanceRecord.marked_at, AttendanceRecord.changed_at,
+                Student.student_number, User.full_name,
+            )
+            .outerjoin(Student, AttendanceRecord.student_id == Student.id)
+            .outerjoin(User, Student.id == User.id)
+            .filter(db.or_(*newer))
+            .order_by(AttendanceRecord.changed_at, AttendanceRecord.id)
+            .all()
+        )
+        with self._lock:
+            for row in rows:
+                channel = channels[row.session_id]
+                if row.changed_at is not None and (channel.cursor is None or row.changed_at > channel.cursor):
+                    channel.cursor = row.changed_at
+                if channel.status.get(row.id) == row.status:
+                    continue
+                channel.status[row.id] = row.status
+                channel.events.append((row.id, json.dumps({
+                    "id": row.id,
+                    "student_id": row.student_id,
+                    "student_name": row.full_name or "Unknown",
+                    "student_number": row.student_number or "Unknown",
+                    "timestamp": row.marked_at.isoformat() if row.marked_at else None,
+                    "status": row.status,
+                })))
+            for channel in channels.values():
+                channel.ready = True
+            self._changed.notify_all()
+
+
+live_feed = LiveFeed()
@@ -1,9 +1,10 @@
 import os
-from flask import Flask, Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Flask, Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager, login_required, current_user
 from datetime import datetime
+from sqlalchemy.orm import contains_eager, joinedload
 from .models import (
     db,
     User,
@@ -16,8 +17,11 @@ from .models import (
     Module,
     LecturerAssignment,
     AttendanceSession,
-    AttendanceRecord
+    AttendanceRecord,
+    AttendanceSummary
 )
+from .admin_routes import load_dashboard
+from .attendance_store import set_marks, apply_marks_rule
 
 
 # ----------------------------
@@ -57,35 +61,7 @@ def admin_dashboard():
         flash("Access denied. Admins only.", "danger")
         return redirect(url_for("main_bp.dashboard"))
 
-    lecturers = (
-        db.session.query(Lecturer, Department, Faculty)
-        .join(Department, Lecturer.department_id == Department.id, isouter=True)
-        .join(Faculty, Department.faculty_id == Faculty.id, isouter=True)
-        .all()
-    )
-
-    faculties = Faculty.query.all()
-    modules = Module.query.all()
-
-    assignments = (
-        db.session.query(LecturerAssignment)
-        .join(Lecturer)
-        .join(Faculty)
-        .join(Department)
-        .join(Course)
-        .join(Module)
-        .order_by(LecturerAssignment.assigned_at.desc())
-        .all()
-    )
-
-    return render_template(
-        "admin_dashboard.html",
-        admin=current_user,
-        lecturers=[l[0] for l in lecturers],
-        faculties=faculties,
-        modules=modules,
-        assignments=assignments
-    )
+    return render_template("admin_dashboard.html", admin=current_user, **load_dashboard())
 
 
 # ----------------------------
@@ -150,10 +126,16 @@ def dashboard():
         flash("Lecturer profile not found.", "danger")
         return redirect(url_for("main_bp.landing"))
 
-    assignments = LecturerAssignment.query.filter_by(lecturer_id=lecturer.id).all()
+    assignments = (
+        LecturerAssignment.query
+        .options(joinedload(LecturerAssignment.module),
+                 joinedload(LecturerAssignment.department),
+                 joinedload(LecturerAssignment.faculty))
+        .filter_by(lecturer_id=lecturer.id)
+        .all()
+    )
     module_ids = [a.module_id for a in assignments]
 
-    # --- NEW LOGIC START ---
     # Get all courses related to the lecturer's assigned modules
     course_ids = (
         db.session.query(Module.course_id)
@@ -163,38 +145,36 @@ def dashboard():
     )
     course_ids = [c[0] for c in course_ids]
 
-    # Fetch all students enrolled in those courses
+    # Fetch all students enrolled in those courses (names in the same query)
     students = (
         Student.query
-        .filter(Student.course_id.in_(course_ids))
         .join(User)
+        .options(contains_eager(Student.user))
+        .filter(Student.course_id.in_(course_ids))
         .all()
     )
-    # --- NEW LOGIC END ---
 
+    # One precomputed row per (student, module), see AttendanceSummary
+    rows = AttendanceSummary.query.filter(AttendanceSummary.module_id.in_(module_ids)).all()
 
-    attendance_records = (
-        AttendanceRecord.query
-        .join(Student)
-        .filter(Student.module_id.in_(module_ids))
-        .all()
-    )
-
-    print(students[0].user.full_name if students else "No students found")
+    # (student_id, module_id) -> {"present", "sessions", "marks"}
+    attendance_summary = {}
     attendance_scores = {}
-    for record in attendance_records:
-        student_id = record.student_id
-        if record.status == "present":
-            attendance_scores[student_id] = attendance_scores.get(student_id, 0) + 10
+    for row in rows:
+        attendance_summary[(row.student_id, row.module_id)] = {
+            "present": row.attended,
+            "sessions": row.sessions,
+            "marks": row.marks,
+        }
+        attendance_scores[row.student_id] = attendance_scores.get(row.student_id, 0) + 10 * row.attended
 
-    print(attendance_records)
     return render_template(
         "dashboard.html",
         lecturer=current_user,
         lecturer_profile=lecturer,
         assignments=assignments,
         students=students,
-        attendance_records=attendance_records,
+        attendance_summary=attendance_summary,
         attendance_scores=attendance_scores
     )
 
@@ -203,6 +183,14 @@ def dashboard():
 # ----------------------------
 # LECTURER: Allocate Attendance Marks
 # ----------------------------
+def parse_marks(value):
+    """Marks for one record, 0..MARKS_MAX; raises ValueError otherwise."""
+    marks = int(value)
+    if not 0 <= marks <= current_app.config["MARKS_MAX"]:
+        raise ValueError(f"marks must be between 0 and {current_app.config['MARKS_MAX']}")
+    return marks
+
+
 @main_bp.route("/lecturer/allocate_marks", methods=["POST"])
 @login_required
 def allocate_marks():
@@ -212,21 +200,37 @@ def allocate_marks():
 
     student_id = request.form.get("student_id")
     module_id = request.form.get("module_id")
-    marks = int(request.form.get("marks", 0))
+    session_id = request.form.get("session_id")  # optional: a specific session of the module
 
     if not student_id or not module_id:
         flash("Missing data. Please select a valid student and module.", "warning")
         return redirect(url_for("main_bp.dashboard"))
 
+    try:
+        student_id, module_id = int(student_id), int(module_id)
+        session_id = int(session_id) if session_id else None
+    except ValueError:
+        flash("Invalid student, module or session.", "warning")
+        return redirect(url_for("main_bp.dashboard"))
+    try:
+        marks = parse_marks(request.form.get("marks", 0))
+    except ValueError:
+        flash(f"Marks must be a whole number between 0 and {current_app.config['MARKS_MAX']}.", "warning")
+        return redirect(url_for("main_bp.dashboard"))
+
     student = Student.query.get(student_id)
     if not student:
         flash("Student not found.", "danger")
         return redirect(url_for("main_bp.dashboard"))
 
-    # Check attendance session for the module
-    record = AttendanceRecord.query.join(AttendanceSession)\
+    # Check attendance session for the module; marks go on the first scanned session
+    query = AttendanceRecord.query.join(AttendanceSession)\
         .filter(AttendanceRecord.student_id == student_id,
-                AttendanceSession.module_id == module_id)\
+                AttendanceSession.module_id == module_id)
+    if session_id:
+        query = query.filter(AttendanceRecord.session_id == session_id)
+    record = query\
+        .order_by(db.case((AttendanceRecord.status == "present", 0), else_=1), AttendanceRecord.id)\
         .first()
 
     if not record:
@@ -237,13 +241,69 @@ def allocate_marks():
         flash("Cannot allocate marks — student has not scanned their face.", "danger")
         return redirect(url_for("main_bp.dashboard"))
 
-    record.attendance_marks = marks
+    # Through the bulk writer, so the module summary is refreshed with it
+    set_marks(module_id, [(record.student_id, record.session_id, marks)])
     db.session.commit()
 
     flash(f"✅ {marks} marks allocated to {student.user.full_name}.", "success")
     return redirect(url_for("main_bp.dashboard"))
 
 
+# ----------------------------
+# LECTURER: Bulk Marks API
+# ----------------------------
+@main_bp.route("/lecturer/api/marks", methods=["POST"])
+@login_required
+def api_bulk_marks():
+    """
+    Allocate marks for a whole module in one request.
+
+    Explicit: {"module_id": 1, "marks": [{"student_id": 5, "session_id": 9, "marks": 10}, ...]}
+      one executemany UPDATE; only present records get marks.
+    Rule:     {"module_id": 1, "rule": {"per_present": 10}}
+      every record of the module: per_present if present, else 0, in one UPDATE.
+    """
+    if current_user.role != "lecturer":
+        return jsonify({"msg":"Lecturers only"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        module_id = int(data.get("module_id"))
+    except (TypeError, ValueError):
+        return jsonify({"msg":"Invalid module_id"}), 400
+
+    assigned = db.session.query(LecturerAssignment.id).filter_by(
+        lecturer_id=current_user.id, module_id=module_id
+    ).first()
+    if not assigned:
+        return jsonify({"msg":"You are not assigned to this module"}), 403
+
+    rule = data.get("rule")
+    if rule is not None:
+        try:
+            per_present = parse_marks(rule.get("per_present"))
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({"msg":f"rule.per_present must be a number between 0 and {current_app.config['MARKS_MAX']}"}), 400
+        updated = apply_marks_rule(module_id, per_present)
+        db.session.commit()
+        return jsonify({"msg":"Marks applied", "updated": updated}), 200
+
+    entries = data.get("marks")
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"msg":"marks must be a non-empty list"}), 400
+    if len(entries) > current_app.config["MARKS_BATCH_LIMIT"]:
+        return jsonify({"msg":f"At most {current_app.config['MARKS_BATCH_LIMIT']} entries per request"}), 413
+    try:
+        items = [(int(e["student_id"]), int(e["session_id"]), parse_marks(e["marks"])) for e in entries]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"msg":"Each entry needs numeric student_id and session_id, and marks between 0 and "
+                              f"{current_app.config['MARKS_MAX']}"}), 400
+
+    result = set_marks(module_id, items)
+    db.session.commit()
+    return jsonify({"msg":"Marks allocated", **result}), 200
+
+
 # ----------------------------
 # ADMIN AJAX ENDPOINTS
 # ----------------------------
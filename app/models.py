@@ -18,6 +18,10 @@ def generate_employee_id(prefix="DUT-L"):
 # ------------------------------------------------------------
 class User(UserMixin, db.Model):
     __tablename__ = "users"
+    # Admin lecturer listing pages by (full_name, id)
+    __table_args__ = (
+        db.Index("ix_users_full_name_id", "full_name", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(120), nullable=False)
@@ -137,6 +141,10 @@ class Admin(db.Model):
 # ------------------------------------------------------------
 class LecturerAssignment(db.Model):
     __tablename__ = "lecturer_assignments"
+    # Admin assignment listing pages by (assigned_at, id), newest first
+    __table_args__ = (
+        db.Index("ix_lecturer_assignments_assigned_at_id", "assigned_at", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     lecturer_id = db.Column(db.Integer, db.ForeignKey("lecturers.id"), nullable=False)
@@ -167,7 +175,10 @@ class Student(db.Model):
     department_id = db.Column(db.Integer, db.ForeignKey("departments.id"))
     course_id = db.Column(db.Integer, db.ForeignKey("courses.id"))
     module_id = db.Column(db.Integer, db.ForeignKey("modules.id"))
-    face_encoding = db.Column(db.Text, nullable=True)
+    # Packed float32 vector, see app/face_codec.py (legacy rows hold JSON)
+    face_encoding = db.Column(db.LargeBinary, nullable=True)
+    # Set when registration or dedup_faces.py finds the same face enrolled earlier
+    face_duplicate_of = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=True)
 
     user = db.relationship("User", backref=db.backref("student_profile", uselist=False))
     attendance_records = db.relationship(
@@ -180,11 +191,46 @@ class Student(db.Model):
     def __repr__(self):
         return f"<Student {self.student_number} - {self.user.full_name}>"
 
+# ------------------------------------------------------------
+# Face Gallery Change Log
+# ------------------------------------------------------------
+class FaceGalleryChange(db.Model):
+    """One row per committed change to a student's face encoding.
+
+    The highest id doubles as the gallery version: each worker remembers the
+    last id it applied and replays only newer rows (see app/face_index.py).
+    """
+    __tablename__ = "face_gallery_changes"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: removals must outlive the deleted student row
+    student_id = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<FaceGalleryChange {self.id} student {self.student_id}>"
+
+# ------------------------------------------------------------
+# Cache Versions
+# ------------------------------------------------------------
+class CacheVersion(db.Model):
+    """A counter per process-level cache, bumped in the same transaction as
+    the change it covers so other workers notice with one cheap SELECT.
+    """
+    __tablename__ = "cache_versions"
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 # ------------------------------------------------------------
 # Attendance Session
 # ------------------------------------------------------------
 class AttendanceSession(db.Model):
     __tablename__ = "attendance_sessions"
+    # The auto-close sweep and active-session lookups filter on these
+    __table_args__ = (
+        db.Index("ix_attendance_sessions_active_end", "is_active", "end_time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     module_id = db.Column(db.Integer, db.ForeignKey("modules.id"), nullable=False)
@@ -210,6 +256,14 @@ class AttendanceSession(db.Model):
 # ------------------------------------------------------------
 class AttendanceRecord(db.Model):
     __tablename__ = "attendance_records"
+    # One record per student per session; bulk writes rely on it to skip duplicates
+    __table_args__ = (
+        db.UniqueConstraint("session_id", "student_id", name="uq_attendance_session_student"),
+        # Keyset pagination of a session's records by (marked_at, id)
+        db.Index("ix_attendance_session_marked_at", "session_id", "marked_at", "id"),
+        # Live feed polling by write time
+        db.Index("ix_attendance_session_changed_at", "session_id", "changed_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey("attendance_sessions.id"), nullable=False)
@@ -218,9 +272,56 @@ class AttendanceRecord(db.Model):
     status = db.Column(db.String(20), nullable=False, default="present")  # usually default present if scanned
     marked_at = db.Column(db.DateTime, default=datetime.utcnow)
     attendance_marks = db.Column(db.Integer, default=0)
+    # When the row was last written (marked_at is when the scan was captured)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     session = db.relationship("AttendanceSession", back_populates="attendance_records")
     student = db.relationship("Student", back_populates="attendance_records")
 
     def __repr__(self):
         return f"<Attendance Student {self.student_id} - {self.status} - Marks {self.attendance_marks}>"
+
+# ------------------------------------------------------------
+# Attendance Summary
+# ------------------------------------------------------------
+class AttendanceSummary(db.Model):
+    """Per-student, per-module totals of attendance_records.
+
+    Kept current in the same transaction as every record write in
+    app/attendance_store.py: new scans add to their row, bulk writes
+    recompute theirs. Those are the only writers of attendance records.
+    create_app() builds the table when it is empty and records exist;
+    rebuild_attendance_summaries.py recomputes it from scratch and
+    reports drift.
+    """
+    __tablename__ = "attendance_summaries"
+
+    # No foreign keys: rows are refreshed after the records (and students) they count are deleted
+    student_id = db.Column(db.Integer, primary_key=True)
+    module_id = db.Column(db.Integer, primary_key=True)
+    sessions = db.Column(db.Integer, nullable=False, default=0)  # records, present or absent
+    attended = db.Column(db.Integer, nullable=False, default=0)
+    marks = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<AttendanceSummary Student {self.student_id} Module {self.module_id} - {self.attended}/{self.sessions}>"
+
+# ------------------------------------------------------------
+# Scanner Sync Keys
+# ------------------------------------------------------------
+class ScannerSyncKey(db.Model):
+    """Idempotency key of one offline scan, with the outcome first recorded for it.
+
+    A scanner that retries a sync gets the stored outcome back instead of a
+    second write (see /attendance/api/sync).
+    """
+    __tablename__ = "scanner_sync_keys"
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)
+    device_id = db.Column(db.String(64), nullable=True)
+    session_id = db.Column(db.Integer, nullable=False)
+    student_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # created / duplicate
+    captured_at = db.Column(db.DateTime, nullable=True)
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow)
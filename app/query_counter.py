@@ -0,0 +1,35 @@
+# app/query_counter.py
+from flask import g, has_request_context
+from sqlalchemy import event
+
+from .models import db
+
+HEADER = "X-SQL-Queries"
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_queries = g.get("sql_queries", 0) + 1
+
+
+def reset_count():
+    g.sql_queries = 0
+
+
+def add_header(response):
+    response.headers[HEADER] = str(g.get("sql_queries", 0))
+    return response
+
+
+def init_app(app):
+    """
+    Count the SQL statements each request runs and return the count in an
+    X-SQL-Queries response header. Debug aid only (SQL_QUERY_COUNTER):
+    a page whose count grows with its rows has an N+1 somewhere.
+    """
+    if not app.config["SQL_QUERY_COUNTER"]:
+        return
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+    app.before_request(reset_count)
+    app.after_request(add_header)
@@ -0,0 +1,296 @@
+# app/session_registry.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import db, AttendanceSession, AttendanceRecord, Module, Student, User, CacheVersion
+from .attendance_store import insert_ignore
+from .face_index import get_face_gallery
+
+VERSION_NAME = "attendance_sessions"
+
+
+class ActiveSession:
+    """An open attendance session and the students already recorded in it."""
+
+    __slots__ = ("id", "module_id", "course_id", "end_time", "seen", "names")
+
+    def __init__(self, id, module_id, course_id, end_time=None, seen=None, names=None):
+        self.id = id
+        self.module_id = module_id
+        self.course_id = course_id
+        self.end_time = end_time
+        self.seen = seen  # set of student ids, loaded on first use
+        self.names = names  # roster student_id -> (student_number, full_name), set by warm_up
+
+    @property
+    def expired(self):
+        return self.end_time is not None and self.end_time <= datetime.utcnow()
+
+
+# ---------------------- Version counter ----------------------
+def read_version():
+    return db.session.query(CacheVersion.version).filter(CacheVersion.name == VERSION_NAME).scalar() or 0
+
+
+def bump_version(connection):
+    """Bump the sessions version inside the caller's transaction."""
+    table = CacheVersion.__table__
+    insert_ignore(table, [{"name": VERSION_NAME, "version": 0}], connection=connection)
+    connection.execute(
+        table.update().where(table.c.name == VERSION_NAME).values(version=table.c.version + 1)
+    )
+
+
+# ---------------------- Registry ----------------------
+class SessionRegistry:
+    """
+    Process-level view of the open attendance sessions.
+
+    Answers "is this session open?" and "is this student already marked?"
+    from memory. The most recently used INACTIVE_LIMIT closed sessions are
+    remembered too, so scans against them skip the database as well.
+    Unknown ids are not remembered: anyone can send those, and a cache of
+    them would grow without bound.
+
+    Every change to an attendance session bumps a row in cache_versions in
+    the same transaction. Workers compare that counter (one SELECT, at most
+    every ATTENDANCE_REGISTRY_SYNC_INTERVAL seconds) and reload the open
+    sessions when it moved. A session id not in the registry is looked up
+    in the database once, so a session started by another worker is never
+    refused while the counter is being checked.
+
+    Seen-sets only ever hold students that really are recorded. A miss
+    falls through to the database insert, which ignores duplicates.
+    """
+
+    INACTIVE_LIMIT = 10000
+    WARMUP_LIMIT = 100
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._active = {}
+        self._inactive = OrderedDict()  # closed session ids, least recently used first
+        self.version = None
+        self.loaded = False
+        self._last_sync = 0.0
+        self.warmups = OrderedDict()  # session_id -> warm-up time in ms, the latest WARMUP_LIMIT
+
+    def load(self):
+        with self._lock:
+            version = read_version()
+            rows = (
+                db.session.query(AttendanceSession.id, AttendanceSession.module_id,
+                                 AttendanceSession.end_time, Module.course_id)
+                .join(Module, AttendanceSession.module_id == Module.id)
+                .filter(AttendanceSession.is_active.is_(True))
+                .all()
+            )
+            previous = self._active
+            self._active = {}
+            for row in rows:
+                kept = previous.get(row.id)
+                self._active[row.id] = ActiveSession(row.id, row.module_id, row.course_id, row.end_time,
+                                                     kept and kept.seen, kept and kept.names)
+            self._inactive = OrderedDict()
+            self.version = version
+            self._last_sync = time.monotonic()
+            self.loaded = True
+
+    def invalidate(self):
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+
+    def maybe_sync(self):
+        interval = current_app.config["ATTENDANCE_REGISTRY_SYNC_INTERVAL"]
+        if interval >= 0 and time.monotonic() - self._last_sync >= interval:
+            self._last_sync = time.monotonic()
+            if read_version() != self.version:
+                self.load()
+
+    # ---------------------- Lookups ----------------------
+    def lookup(self, session_id):
+        """
+        Returns ``(ActiveSession, "active")``, or ``(None, "closed")`` /
+        ``(None, "missing")``.
+        """
+        entry = self._active.get(session_id)
+        if entry is not None:
+            # Past its end_time but not yet closed by the scheduler
+            return (None, "closed") if entry.expired else (entry, "active")
+        if session_id in self._inactive:
+            with self._lock:
+                if session_id in self._inactive:
+                    self._inactive.move_to_end(session_id)
+                    return None, "closed"
+
+        row = (
+            db.session.query(AttendanceSession.id, AttendanceSession.module_id, AttendanceSession.is_active,
+                             AttendanceSession.end_time, Module.course_id)
+            .join(Module, AttendanceSession.module_id == Module.id)
+            .filter(AttendanceSession.id == session_id)
+            .first()
+        )
+        with self._lock:
+            if row and row.is_active:
+                entry = self._active.setdefault(
+                    session_id, ActiveSession(row.id, row.module_id, row.course_id, row.end_time)
+                )
+                return (None, "closed") if entry.expired else (entry, "active")
+            if row is None:
+                return None, "missing"
+            self._inactive[session_id] = True
+            if len(self._inactive) > self.INACTIVE_LIMIT:
+                self._inactive.popitem(last=False)
+            return None, "closed"
+
+    def _seen(self, entry):
+        if entry.seen is None:
+            recorded = {
+                student_id for student_id, in
+                db.session.query(AttendanceRecord.student_id)
+                .filter(AttendanceRecord.session_id == entry.id, AttendanceRecord.status != "absent")
+            }
+            with self._lock:
+                if entry.seen is None:
+                    entry.seen = recorded
+        return entry.seen
+
+    def is_recorded(self, entry, student_id):
+        return student_id in self._seen(entry)
+
+    def mark_recorded(self, entry, student_ids):
+        """Call after the records are committed (or durably buffered)."""
+        with self._lock:
+            self._seen(entry).update(student_ids)
+
+    def student_name(self, entry, student_id):
+        """``(student_number, full_name)`` from the warmed roster, else None."""
+        names = entry.names
+        return names.get(student_id) if names is not None else None
+
+    # ---------------------- Warm-up ----------------------
+    def warm_up(self, session_id):
+        """
+        Load everything the first scan of a session would otherwise load
+        cold: the registry entry and its seen-set, the face gallery and the
+        session's roster rows in it, and the roster's names. Returns the
+        time taken in ms (None if the session is not open).
+        """
+        start = time.perf_counter()
+        self.ensure_loaded()
+        entry, _ = self.lookup(session_id)
+        if entry is None:
+            return None
+        self._seen(entry)
+
+        gallery = get_face_gallery()
+        gallery.scope_rows(entry.module_id, entry.course_id)
+
+        names = {
+            row.id: (row.student_number, row.full_name)
+            for row in db.session.query(Student.id, Student.student_number, User.full_name)
+            .join(User, Student.id == User.id)
+            .filter(db.or_(Student.module_id == entry.module_id, Student.course_id == entry.course_id))
+        }
+        with self._lock:
+            entry.names = names
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.warmups.pop(session_id, None)
+            self.warmups[session_id] = round(elapsed_ms, 1)
+            if len(self.warmups) > self.WARMUP_LIMIT:
+                self.warmups.popitem(last=False)
+        return elapsed_ms
+
+    def prewarm(self, app, session_id):
+        """Run warm_up for ``session_id`` on a background thread."""
+        if not app.config["ATTENDANCE_PREWARM"]:
+            return
+
+        def run():
+            with app.app_context():
+                try:
+                    elapsed_ms = self.warm_up(session_id)
+                    if elapsed_ms is not None:
+                        print(f"Warmed attendance session {session_id} in {elapsed_ms:.1f} ms")
+                except Exception as e:
+                    print(f"❌ Session warm-up failed: {e}")
+                finally:
+                    db.session.remove()
+
+        threading.Thread(target=run, name=f"session-warmup-{session_id}", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "active": len(self._active),
+                "warmup_ms": dict(self.warmups),
+            }
+
+    def forget(self, session_ids):
+        """Drop sessions this worker just changed; the next lookup reloads them."""
+        with self._lock:
+            for session_id in session_ids:
+                self._active.pop(session_id, None)
+                self._inactive.pop(session_id, None)
+            # Our own bump moved the counter; reload rather than trust it
+            self._last_sync = 0.0
+
+
+session_registry = SessionRegistry()
+
+
+def get_session_registry():
+    """Return the process-wide registry, loading it on first use."""
+    session_registry.ensure_loaded()
+    session_registry.maybe_sync()
+    return session_registry
+
+
+# ---------------------- Session hooks ----------------------
+# Any flushed change to an attendance session (start, stop, edit, delete)
+# bumps the version in the same transaction; once it commits this worker
+# drops the session from its registry straight away.
+PENDING_KEY = "attendance_session_changes"
+WATCHED_ATTRS = ("is_active", "module_id", "end_time")
+
+
+@event.listens_for(Session, "after_flush")
+def collect_session_changes(session, flush_context):
+    changed = {obj.id for obj in session.new if isinstance(obj, AttendanceSession)}
+    changed.update(obj.id for obj in session.deleted if isinstance(obj, AttendanceSession))
+    for obj in session.dirty:
+        if isinstance(obj, AttendanceSession):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in WATCHED_ATTRS):
+                changed.add(obj.id)
+    if changed:
+        pending = session.info.setdefault(PENDING_KEY, set())
+        if not pending:
+            bump_version(session.connection())
+        pending.update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def apply_session_changes(session):
+    changed = session.info.pop(PENDING_KEY, None)
+    if changed:
+        session_registry.forget(changed)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_session_changes(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
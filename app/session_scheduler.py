@@ -0,0 +1,92 @@
+# app/session_scheduler.py
+import threading
+from datetime import datetime, timedelta
+
+from .models import db, AttendanceSession
+from .attendance_store import record_absences
+from .session_registry import bump_version, session_registry
+
+
+def close_expired_sessions(default_duration=0):
+    """
+    Close every active session whose end_time has passed, with one UPDATE,
+    after recording their missing students absent with one INSERT ... SELECT.
+    Sessions without an end_time (started before ATTENDANCE_DEFAULT_DURATION
+    existed, or while it was 0) are closed once default_duration minutes
+    have passed since they started; their end_time is set to now.
+    Returns the number of sessions closed. Commits.
+    """
+    table = AttendanceSession.__table__
+    now = datetime.utcnow()
+    past_end = db.and_(table.c.end_time.isnot(None), table.c.end_time <= now)
+    if default_duration > 0:
+        overran = db.and_(table.c.end_time.is_(None),
+                          table.c.start_time <= now - timedelta(minutes=default_duration))
+        past_end = db.or_(past_end, overran)
+    expired = (table.c.is_active.is_(True), past_end)
+    record_absences(*expired, marked_at=now)
+    result = db.session.execute(
+        table.update().where(*expired)
+        .values(is_active=False, end_time=db.func.coalesce(table.c.end_time, now))
+    )
+    closed = result.rowcount
+    if closed:
+        bump_version(db.session.connection())
+    db.session.commit()
+    if closed:
+        session_registry.forget(())
+    return closed
+
+
+class SessionScheduler:
+    """
+    Closes expired attendance sessions every ATTENDANCE_AUTOCLOSE_INTERVAL
+    seconds (0 = off). Every worker runs one; the UPDATE is idempotent, so
+    they never step on each other.
+
+    The thread starts with the first request a process serves, so scripts,
+    CLI commands, the reloader's watcher process and face shard workers,
+    which all call create_app() but never serve, do not run one. Test
+    clients (app.testing) do not start it either.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        interval = app.config["ATTENDANCE_AUTOCLOSE_INTERVAL"]
+        if interval <= 0:
+            return
+
+        @app.before_request
+        def start_session_scheduler():
+            if self._thread is None and not app.testing:
+                self.start(app, interval)
+
+    def start(self, app, interval):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(app, interval), name="session-autoclose", daemon=True)
+            self._thread.start()
+
+    def _run(self, app, interval):
+        while not self._stop.wait(interval):
+            with app.app_context():
+                try:
+                    closed = close_expired_sessions(app.config["ATTENDANCE_DEFAULT_DURATION"])
+                    if closed:
+                        print(f"Closed {closed} expired attendance sessions")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Session auto-close failed: {e}")
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stop.set()
+
+
+session_scheduler = SessionScheduler()
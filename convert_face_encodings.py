@@ -0,0 +1,80 @@
+# convert_face_encodings.py
+"""
+Convert Student.face_encoding rows from JSON text to the packed float32
+format in app/face_codec.py.
+
+Safe to re-run: rows that are already packed are skipped. On MySQL the
+column is switched to a BLOB first if it is still TEXT.
+"""
+import sys
+
+from sqlalchemy import bindparam, inspect, text
+
+from app import create_app
+from app.models import db, Student
+from app.face_codec import is_packed, pack_encoding, decode_encoding
+
+BATCH_SIZE = 1000
+
+app = create_app()
+
+with app.app_context():
+    # -----------------------------
+    # Make sure the column holds bytes
+    # -----------------------------
+    column = next(c for c in inspect(db.engine).get_columns("students") if c["name"] == "face_encoding")
+    if db.engine.dialect.name == "mysql" and "TEXT" in str(column["type"]).upper():
+        print("⚠️ Changing students.face_encoding from TEXT to BLOB...")
+        db.session.execute(text("ALTER TABLE students MODIFY face_encoding BLOB NULL"))
+        db.session.commit()
+
+    table = Student.__table__
+    update_stmt = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(face_encoding=bindparam("packed"))
+    )
+
+    # -----------------------------
+    # Convert in id-ordered batches
+    # -----------------------------
+    last_id = 0
+    converted = skipped = failed = 0
+    bytes_before = bytes_after = 0
+    while True:
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.face_encoding)
+            .where(table.c.id > last_id, table.c.face_encoding.isnot(None))
+            .order_by(table.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row_id, stored in rows:
+            if is_packed(stored):
+                skipped += 1
+                continue
+            try:
+                packed = pack_encoding(decode_encoding(stored))
+            except (ValueError, TypeError, UnicodeDecodeError) as e:
+                print(f"❌ Student {row_id}: cannot convert face encoding ({e})")
+                failed += 1
+                continue
+            bytes_before += len(stored)
+            bytes_after += len(packed)
+            updates.append({"row_id": row_id, "packed": packed})
+
+        if updates:
+            db.session.execute(update_stmt, updates)
+            db.session.commit()
+            converted += len(updates)
+            print(f"… converted {converted} rows (up to student {last_id})")
+
+    print(f"✅ Converted {converted} face encodings, {skipped} already packed, {failed} failed")
+    if converted:
+        print(f"   Size: {bytes_before} → {bytes_after} bytes ({bytes_before / bytes_after:.1f}x smaller)")
+
+    sys.exit(1 if failed else 0)
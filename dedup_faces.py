@@ -0,0 +1,98 @@
+# dedup_faces.py
+"""
+Find every face enrolled under more than one student number.
+
+    python dedup_faces.py                  # stream pairs, then clusters, as JSON lines
+    python dedup_faces.py --tolerance 0.15 # stricter than FACE_DUPLICATE_TOLERANCE
+    python dedup_faces.py --flag           # also set Student.face_duplicate_of
+
+All pairs are scored with blocked matrix products (see
+app.face_ann.iter_duplicate_pairs), so no Python loop runs over pairs of
+students. Each duplicate pair is printed as soon as its block is scored;
+clusters (connected groups of pairs) are printed at the end.
+"""
+import argparse
+import json
+import sys
+
+from app import create_app
+from app.models import db, Student, User
+from app.face_ann import iter_duplicate_pairs
+from app.face_index import face_gallery
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--tolerance", type=float, help="default: FACE_DUPLICATE_TOLERANCE")
+parser.add_argument("--block-size", type=int, default=2048)
+parser.add_argument("--flag", action="store_true", help="mark later students in each cluster as duplicates of the first")
+args = parser.parse_args()
+
+
+def emit(record):
+    print(json.dumps(record), flush=True)
+
+
+app = create_app()
+
+with app.app_context():
+    app.config["FACE_INDEX_MODE"] = "exact"
+    app.config["FACE_INDEX_STORAGE"] = "float32"
+    app.config["FACE_SHARDS"] = 0
+    face_gallery.load()
+    tolerance = args.tolerance if args.tolerance is not None else app.config["FACE_DUPLICATE_TOLERANCE"]
+
+    # -----------------------------
+    # Stream pairs, union them into clusters
+    # -----------------------------
+    parent = {}
+
+    def find(student_id):
+        parent.setdefault(student_id, student_id)
+        while parent[student_id] != student_id:
+            parent[student_id] = parent[parent[student_id]]
+            student_id = parent[student_id]
+        return student_id
+
+    pairs = 0
+    for a, b, score in iter_duplicate_pairs(face_gallery.matrix, face_gallery.ids, 1 - tolerance, args.block_size):
+        pairs += 1
+        emit({"type": "pair", "student_ids": [a, b], "score": round(score, 4)})
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = {}
+    for student_id in parent:
+        clusters.setdefault(find(student_id), []).append(student_id)
+
+    # -----------------------------
+    # Report clusters with student numbers
+    # -----------------------------
+    members = [student_id for cluster in clusters.values() for student_id in cluster]
+    details = {}
+    if members:
+        rows = (
+            db.session.query(Student.id, Student.student_number, User.full_name)
+            .join(User, Student.id == User.id)
+            .filter(Student.id.in_(members))
+            .all()
+        )
+        details = {row.id: {"student_number": row.student_number, "full_name": row.full_name} for row in rows}
+
+    updates = []
+    for root, cluster in sorted(clusters.items()):
+        cluster.sort()
+        emit({"type": "cluster", "students": [dict(id=s, **details.get(s, {})) for s in cluster]})
+        updates.extend({"row_id": s, "original": cluster[0]} for s in cluster[1:])
+
+    if args.flag and updates:
+        table = Student.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == db.bindparam("row_id"))
+            .values(face_duplicate_of=db.bindparam("original")),
+            updates
+        )
+        db.session.commit()
+
+    print(f"✅ {face_gallery.size} faces scanned: {pairs} duplicate pairs in {len(clusters)} clusters"
+          + (f", {len(updates)} students flagged" if args.flag else ""), file=sys.stderr)
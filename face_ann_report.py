@@ -0,0 +1,73 @@
+# face_ann_report.py
+"""
+Recall / latency report for the IVF face index against the exact scan.
+
+    python face_ann_report.py                      # encodings from the database
+    python face_ann_report.py --synthetic 100000   # random clustered gallery
+    python face_ann_report.py --nlist 512 --json
+    python face_ann_report.py --int8               # also report int8 storage drift
+
+Queries are gallery faces with a little noise added, which is what a
+scanner sees for an enrolled student. Pick the smallest FACE_IVF_NPROBE
+whose recall is acceptable.
+"""
+import argparse
+import json
+
+import numpy as np
+
+from app.face_ann import recall_report, quantization_report, synthetic_encodings, noisy_probes
+
+
+def database_gallery():
+    from app import create_app
+    from app.face_index import face_gallery
+
+    app = create_app()
+    with app.app_context():
+        app.config["FACE_INDEX_MODE"] = "exact"
+        app.config["FACE_INDEX_STORAGE"] = "float32"
+        app.config["FACE_SHARDS"] = 0
+        face_gallery.load()
+        return face_gallery.matrix
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--synthetic", type=int, metavar="N", help="use N random encodings instead of the database")
+parser.add_argument("--dim", type=int, default=128)
+parser.add_argument("--queries", type=int, default=500)
+parser.add_argument("--noise", type=float, default=0.05)
+parser.add_argument("--k", type=int, default=1)
+parser.add_argument("--nlist", type=int, default=0, help="0 = sqrt(gallery size)")
+parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--int8", action="store_true", help="report int8 storage memory and score drift")
+parser.add_argument("--json", action="store_true", help="print machine-readable output")
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+matrix = synthetic_encodings(args.synthetic, args.dim, rng) if args.synthetic else database_gallery()
+if len(matrix) == 0:
+    raise SystemExit("No face encodings to index.")
+
+queries = noisy_probes(matrix[rng.integers(len(matrix), size=args.queries)], args.noise, rng)
+
+report = recall_report(matrix, queries, k=args.k, nlist=args.nlist or None, nprobes=args.nprobe, seed=args.seed)
+int8 = quantization_report(matrix, queries, k=args.k) if args.int8 else None
+
+if args.json:
+    output = {"gallery_size": len(matrix), "dim": matrix.shape[1], "k": args.k, "results": report}
+    if int8:
+        output["int8"] = int8
+    print(json.dumps(output, indent=2))
+else:
+    print(f"Gallery: {len(matrix)} x {matrix.shape[1]}, {len(queries)} queries, recall@{args.k}")
+    print(f"{'mode':<6} {'nprobe':>6} {'recall':>7} {'mean ms':>9} {'p95 ms':>9}")
+    for row in report:
+        print(f"{row['mode']:<6} {str(row['nprobe'] or '-'):>6} {row['recall']:>7.4f} {row['mean_ms']:>9.3f} {row['p95_ms']:>9.3f}")
+    if int8:
+        print()
+        print(f"int8 storage: {int8['int8_bytes'] / 2**20:.1f} MiB vs {int8['float32_bytes'] / 2**20:.1f} MiB float32")
+        print(f"score drift vs float32 cosine: mean {int8['score_drift_mean']:.5f}, max {int8['score_drift_max']:.5f}")
+        for row in int8["rerank"]:
+            print(f"  re-rank depth {row['depth']:>4}: recall@{args.k} {row['recall']:.4f}")
@@ -0,0 +1,241 @@
+# face_benchmark.py
+"""
+Benchmark the face verification path and sweep the match tolerance.
+
+    python face_benchmark.py                                  # 1k and 10k students, 128-d
+    python face_benchmark.py --sizes 1000 10000 100000 --dims 128 512
+    python face_benchmark.py --mode ivf --storage int8 --output bench_output.txt
+
+For every gallery size and dimension this builds a throwaway SQLite
+database of synthetic clustered encodings, starts the app in-process and
+measures:
+
+  * gallery cold-load time
+  * p50/p95/p99 latency and throughput of POST /api/face/verify
+  * per-face throughput of POST /api/face/verify/batch
+  * FAR / FRR / misidentification rate for each tolerance in --tolerances
+
+Genuine probes are enrolled faces plus noise; impostor probes come from
+the same distribution but are never enrolled. Results are written as one
+JSON document so runs can be diffed release over release.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.face_ann import synthetic_encodings, noisy_probes
+from app.face_codec import pack_encoding
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+parser.add_argument("--dims", type=int, nargs="+", default=[128])
+parser.add_argument("--mode", choices=["exact", "ivf"], default="exact", help="FACE_INDEX_MODE")
+parser.add_argument("--storage", choices=["float32", "int8"], default="float32", help="FACE_INDEX_STORAGE")
+parser.add_argument("--requests", type=int, default=300, help="single verify requests to time")
+parser.add_argument("--batch-size", type=int, default=100)
+parser.add_argument("--batches", type=int, default=5)
+parser.add_argument("--probes", type=int, default=2000, help="genuine and impostor probes for the sweep")
+parser.add_argument("--noise", type=float, default=0.08, help="per-dimension noise on genuine probes")
+parser.add_argument("--spread", type=float, default=1.0, help="per-dimension spread of faces around cohort centres")
+parser.add_argument("--tolerances", type=float, nargs="+",
+                    default=[0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6])
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output", help="write JSON here instead of stdout")
+args = parser.parse_args()
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def percentiles(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms)
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+    }
+
+
+def build_app(database_path):
+    """Create the app on a fresh SQLite file; the app's own prints go to stderr."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    # No session auto-close sweeps against the throwaway database
+    os.environ["ATTENDANCE_AUTOCLOSE_INTERVAL"] = "0"
+    from app import create_app
+
+    with contextlib.redirect_stdout(sys.stderr):
+        app = create_app()
+    app.config["FACE_INDEX_MODE"] = args.mode
+    app.config["FACE_INDEX_STORAGE"] = args.storage
+    # Shard workers are spawned by re-running __main__, i.e. this script
+    app.config["FACE_SHARDS"] = 0
+    return app
+
+
+def seed_students(db, encodings):
+    """Bulk-insert one user + student per encoding; returns the student ids."""
+    from app.models import Faculty, Department, Course, Module, User, Student
+
+    faculty = Faculty(name="Benchmark Faculty")
+    db.session.add(faculty)
+    db.session.flush()
+    department = Department(name="Benchmark Department", faculty_id=faculty.id)
+    db.session.add(department)
+    db.session.flush()
+    course = Course(name="Benchmark Course", department_id=department.id)
+    db.session.add(course)
+    db.session.flush()
+    db.session.add(Module(name="Benchmark Module", course_id=course.id))
+    db.session.commit()
+
+    ids = np.arange(1, len(encodings) + 1)
+    for start in range(0, len(encodings), 5000):
+        chunk = range(start, min(start + 5000, len(encodings)))
+        db.session.execute(User.__table__.insert(), [
+            {"id": int(ids[i]), "full_name": f"Student {i}", "email": f"student{i}@bench.local",
+             "password_hash": "-", "role": "student"}
+            for i in chunk
+        ])
+        db.session.execute(Student.__table__.insert(), [
+            {"id": int(ids[i]), "student_number": f"B{i:07d}", "course_id": course.id,
+             "face_encoding": pack_encoding(encodings[i])}
+            for i in chunk
+        ])
+    db.session.commit()
+    return ids
+
+
+def sweep(gallery, genuine, genuine_ids, impostors):
+    """FAR / FRR per tolerance from one top-1 search of every probe."""
+    def top1(probes):
+        found = gallery.search_batch(list(probes), k=1)
+        return (
+            np.array([m[0][0] if m else -1 for m in found]),
+            np.array([m[0][1] if m else -np.inf for m in found]),
+        )
+
+    genuine_match, genuine_score = top1(genuine)
+    _, impostor_score = top1(impostors)
+
+    rows = []
+    for tolerance in args.tolerances:
+        threshold = 1 - tolerance
+        accepted = genuine_score >= threshold
+        correct = accepted & (genuine_match == genuine_ids)
+        rows.append({
+            "tolerance": tolerance,
+            "far": round(float((impostor_score >= threshold).mean()), 5),
+            "frr": round(float(1 - correct.mean()), 5),
+            "misidentified": round(float((accepted & ~correct).mean()), 5),
+        })
+    return rows
+
+
+def run(size, dim, rng, workdir):
+    from app.models import db
+    from app.face_index import face_gallery, get_face_gallery
+
+    app = build_app(os.path.join(workdir, f"bench_{size}_{dim}.db"))
+    n_impostors = min(args.probes, size)
+    faces = synthetic_encodings(size + n_impostors, dim, rng, spread=args.spread)
+    enrolled, impostors = faces[:size], faces[size:]
+
+    with app.app_context():
+        db.create_all()
+        log(f"… seeding {size} students ({dim}-d)")
+        ids = seed_students(db, enrolled)
+
+        face_gallery.invalidate()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            gallery = get_face_gallery()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        client = app.test_client()
+        picks = rng.integers(size, size=args.requests)
+        probes = noisy_probes(enrolled[picks], args.noise, rng)
+
+        # Warm-up request, then time the single-face path end to end
+        client.post("/api/face/verify", json={"face_encoding": probes[0].tolist()})
+        latencies, matched = [], 0
+        started = time.perf_counter()
+        for probe in probes:
+            t0 = time.perf_counter()
+            response = client.post("/api/face/verify", json={"face_encoding": probe.tolist()})
+            latencies.append((time.perf_counter() - t0) * 1000)
+            matched += bool(response.get_json().get("match"))
+        single_s = time.perf_counter() - started
+
+        batch_latencies = []
+        for _ in range(args.batches):
+            batch = noisy_probes(enrolled[rng.integers(size, size=args.batch_size)], args.noise, rng)
+            t0 = time.perf_counter()
+            client.post("/api/face/verify/batch", json={"encodings": batch.tolist()})
+            batch_latencies.append((time.perf_counter() - t0) * 1000)
+
+        genuine_picks = rng.integers(size, size=args.probes)
+        genuine = noisy_probes(enrolled[genuine_picks], args.noise, rng)
+        rates = sweep(gallery, genuine, ids[genuine_picks], impostors)
+
+        result = {
+            "size": size,
+            "dim": dim,
+            "load_ms": round(load_ms, 1),
+            "gallery": gallery.stats(),
+            "verify": dict(
+                percentiles(latencies),
+                requests=args.requests,
+                throughput_rps=round(args.requests / single_s, 1),
+                match_rate=round(matched / args.requests, 4),
+            ),
+            "verify_batch": dict(
+                percentiles(batch_latencies),
+                batch_size=args.batch_size,
+                faces_per_second=round(args.batch_size * len(batch_latencies) / (sum(batch_latencies) / 1000), 1),
+            ),
+            "sweep": rates,
+        }
+        db.session.remove()
+        db.engine.dispose()
+
+    log(f"✅ {size} x {dim}: p50 {result['verify']['p50_ms']} ms, "
+        f"p99 {result['verify']['p99_ms']} ms, {result['verify']['throughput_rps']} req/s")
+    return result
+
+
+rng = np.random.default_rng(args.seed)
+with tempfile.TemporaryDirectory() as workdir:
+    runs = [run(size, dim, rng, workdir) for dim in args.dims for size in args.sizes]
+
+report = {
+    "meta": {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "mode": args.mode,
+        "storage": args.storage,
+        "noise": args.noise,
+        "spread": args.spread,
+        "seed": args.seed,
+    },
+    "runs": runs,
+}
+
+output = json.dumps(report, indent=2)
+if args.output:
+    with open(args.output, "w") as fh:
+        fh.write(output + "\n")
+    log(f"Results written to {args.output}")
+else:
+    print(output)
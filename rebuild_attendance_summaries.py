@@ -0,0 +1,62 @@
+# rebuild_attendance_summaries.py
+"""
+Recompute attendance_summaries from attendance_records and report drift.
+
+    python rebuild_attendance_summaries.py           # report drift, then rebuild in one transaction
+    python rebuild_attendance_summaries.py --check   # only report drift (exit code 1 if any)
+
+The summaries are normally kept current in the same transaction as each
+record change (see app/attendance_store.py), and create_app() builds them
+once when the table is empty. Drift means something wrote records around
+those paths, e.g. raw SQL, a restored dump, or ORM deletes of sessions
+or students.
+"""
+import argparse
+import json
+import sys
+
+from app import create_app
+from app.models import db, AttendanceSummary
+from app.attendance_store import SUMMARY_COLUMNS, summary_select, ignoring_insert
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--check", action="store_true", help="report drift without rebuilding")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    # -----------------------------
+    # Compare stored rows with a fresh aggregate
+    # -----------------------------
+    expected = {(row[0], row[1]): tuple(row[2:]) for row in db.session.execute(summary_select())}
+    stored = {
+        (row.student_id, row.module_id): (row.sessions, row.attended, row.marks)
+        for row in db.session.query(AttendanceSummary)
+    }
+
+    drift = 0
+    for key in sorted(expected.keys() | stored.keys()):
+        if expected.get(key) != stored.get(key):
+            drift += 1
+            print(json.dumps({
+                "student_id": key[0],
+                "module_id": key[1],
+                "stored": dict(zip(SUMMARY_COLUMNS[2:], stored[key])) if key in stored else None,
+                "expected": dict(zip(SUMMARY_COLUMNS[2:], expected[key])) if key in expected else None,
+            }))
+    print(f"{drift} of {len(expected)} summaries drifted")
+
+    if args.check:
+        sys.exit(1 if drift else 0)
+
+    # -----------------------------
+    # Rebuild everything in bulk
+    # -----------------------------
+    table = AttendanceSummary.__table__
+    db.session.execute(table.delete())
+    db.session.execute(
+        ignoring_insert(table, db.session.get_bind().dialect).from_select(SUMMARY_COLUMNS, summary_select())
+    )
+    db.session.commit()
+    print(f"✅ Rebuilt {len(expected)} attendance summaries")
@@ -0,0 +1,22 @@
+# tests/conftest.py
+import pytest
+
+
+@pytest.fixture()
+def app(tmp_path, monkeypatch):
+    """The app on a fresh SQLite file, with no background threads."""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("SQL_QUERY_COUNTER", "true")
+    monkeypatch.setenv("ATTENDANCE_AUTOCLOSE_INTERVAL", "0")
+    monkeypatch.setenv("ATTENDANCE_WRITE_BEHIND", "false")
+
+    from app import create_app
+    from app.models import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
@@ -0,0 +1,144 @@
+# tests/test_attendance_buffer.py
+"""
+Write-behind log (app/attendance_buffer.py): logs left by a crash are
+replayed once, torn lines and other workers' logs are skipped, and a log
+is only removed once its scans are committed.
+
+    python -m pytest tests
+"""
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from app.attendance_buffer import AttendanceBuffer, fcntl
+
+
+@pytest.fixture()
+def log_dir(tmp_path):
+    path = tmp_path / "attendance_log"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture()
+def buffer(app, log_dir):
+    app.config["ATTENDANCE_WRITE_BEHIND"] = True
+    app.config["ATTENDANCE_LOG_DIR"] = str(log_dir)
+    app.config["ATTENDANCE_FLUSH_INTERVAL"] = 3600  # tests flush by hand
+    buffer = AttendanceBuffer()
+    buffer.init_app(app)
+    yield buffer
+    buffer.close()
+
+
+@pytest.fixture()
+def session_ids(app):
+    """One open session and three students; returns (session id, [student ids])."""
+    from app.models import (db, User, Faculty, Department, Course, Module, Lecturer, Student,
+                            AttendanceSession)
+
+    with app.app_context():
+        faculty = Faculty(name="Faculty")
+        db.session.add(faculty)
+        db.session.flush()
+        department = Department(name="Department", faculty_id=faculty.id)
+        db.session.add(department)
+        db.session.flush()
+        course = Course(name="Course", department_id=department.id)
+        db.session.add(course)
+        db.session.flush()
+        module = Module(name="Module", course_id=course.id)
+        lecturer = User(full_name="Lecturer", email="lecturer@example.com", password_hash="-", role="lecturer")
+        db.session.add_all([module, lecturer])
+        db.session.flush()
+        db.session.add(Lecturer(id=lecturer.id, faculty_id=faculty.id, department_id=department.id))
+        session = AttendanceSession(module_id=module.id, lecturer_id=lecturer.id,
+                                    start_time=datetime.utcnow(), is_active=True)
+        db.session.add(session)
+        students = []
+        for i in range(3):
+            user = User(full_name=f"Student {i}", email=f"student{i}@example.com", password_hash="-")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Student(id=user.id, student_number=f"S{i}", course_id=course.id))
+            students.append(user.id)
+        db.session.commit()
+        return session.id, students
+
+
+def write_log(path, items, torn=False):
+    with open(path, "w", encoding="utf-8") as log:
+        for session_id, student_id in items:
+            log.write(json.dumps({"session_id": session_id, "student_id": student_id,
+                                  "marked_at": datetime.utcnow().isoformat()}) + "\n")
+        if torn:
+            log.write('{"session_id": 1, "stud')
+
+
+def recorded(app):
+    from app.models import AttendanceRecord
+
+    with app.app_context():
+        return sorted((r.session_id, r.student_id) for r in AttendanceRecord.query)
+
+
+def test_replay_commits_left_over_logs_once(app, buffer, log_dir, session_ids):
+    session_id, students = session_ids
+    leftover = log_dir / "scans-1-1-1.log"
+    write_log(leftover, [(session_id, students[0]), (session_id, students[1]), (session_id, students[0])], torn=True)
+
+    buffer.start()
+
+    assert recorded(app) == [(session_id, students[0]), (session_id, students[1])]
+    assert not leftover.exists()
+    # Only this process's own open segment is left
+    assert os.listdir(log_dir) == [os.path.basename(buffer._path)]
+
+
+def test_first_request_starts_the_buffer(app, buffer, session_ids):
+    assert not buffer.enabled
+    app.test_client().get("/")
+    assert buffer.enabled and buffer._thread.is_alive()
+
+
+@pytest.mark.skipif(fcntl is None, reason="no cross-process log locking on this platform")
+def test_replay_skips_logs_locked_by_a_live_worker(app, buffer, log_dir, session_ids):
+    session_id, students = session_ids
+    live = log_dir / "scans-2-2-1.log"
+    write_log(live, [(session_id, students[2])])
+
+    with open(live, "a", encoding="utf-8") as held:
+        fcntl.flock(held, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        buffer.start()
+        assert recorded(app) == []
+        assert live.exists()
+
+
+def test_failed_replay_keeps_the_log(app, buffer, log_dir, session_ids, monkeypatch):
+    session_id, students = session_ids
+    leftover = log_dir / "scans-3-3-1.log"
+    write_log(leftover, [(session_id, students[0])])
+
+    def fail(items):
+        raise RuntimeError("database unavailable")
+    monkeypatch.setattr(buffer, "_write", fail)
+
+    buffer.start()  # must not raise
+
+    assert leftover.exists()
+    assert buffer.enabled
+
+
+def test_flush_commits_and_removes_sealed_segments(app, buffer, log_dir, session_ids):
+    session_id, students = session_ids
+    buffer.start()
+    first_segment = buffer._path
+
+    buffer.append([(session_id, student_id, datetime.utcnow()) for student_id in students])
+    assert buffer.flush()
+
+    assert recorded(app) == [(session_id, student_id) for student_id in students]
+    assert not os.path.exists(first_segment)
+    assert os.listdir(log_dir) == [os.path.basename(buffer._path)]
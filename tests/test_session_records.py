@@ -0,0 +1,93 @@
+# tests/test_session_records.py
+"""
+GET /attendance/api/session/<id>/records must run a fixed number of SQL
+statements whatever the session size (no per-record lookups).
+
+    python -m pytest tests
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def seed_session(app, n_records):
+    """A session with ``n_records`` records; returns (lecturer user id, session id)."""
+    with app.app_context():
+        return _seed_session(n_records)
+
+
+def _seed_session(n_records):
+    from app.models import (db, User, Faculty, Department, Course, Module, Lecturer, Student,
+                            AttendanceSession, AttendanceRecord)
+
+    faculty = Faculty(name="Faculty")
+    db.session.add(faculty)
+    db.session.flush()
+    department = Department(name="Department", faculty_id=faculty.id)
+    db.session.add(department)
+    db.session.flush()
+    course = Course(name="Course", department_id=department.id)
+    db.session.add(course)
+    db.session.flush()
+    module = Module(name="Module", course_id=course.id)
+    lecturer_user = User(full_name="Lecturer", email="lecturer@example.com", password_hash="-", role="lecturer")
+    db.session.add_all([module, lecturer_user])
+    db.session.flush()
+    db.session.add(Lecturer(id=lecturer_user.id, faculty_id=faculty.id, department_id=department.id))
+    session = AttendanceSession(module_id=module.id, lecturer_id=lecturer_user.id,
+                                start_time=datetime.utcnow(), is_active=True)
+    db.session.add(session)
+    db.session.flush()
+
+    start = datetime.utcnow()
+    for i in range(n_records):
+        user = User(full_name=f"Student {i}", email=f"student{i}@example.com", password_hash="-")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Student(id=user.id, student_number=f"S{i:05d}", course_id=course.id))
+        db.session.add(AttendanceRecord(session_id=session.id, student_id=user.id,
+                                        marked_at=start + timedelta(seconds=i)))
+    db.session.commit()
+    return lecturer_user.id, session.id
+
+
+def get_records(app, user_id, session_id, **params):
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session["_user_id"] = str(user_id)
+    response = client.get(f"/attendance/api/session/{session_id}/records", query_string=params)
+    assert response.status_code == 200
+    return response.get_json(), int(response.headers["X-SQL-Queries"])
+
+
+@pytest.mark.parametrize("n_records", [3, 60])
+def test_records_query_count_is_constant(app, n_records):
+    user_id, session_id = seed_session(app, n_records)
+
+    page, first_count = get_records(app, user_id, session_id, limit=20)
+    assert len(page["records"]) == min(n_records, 20)
+
+    queries = [first_count]
+    if page["next"]:
+        older, count = get_records(app, user_id, session_id, limit=20, before=page["next"])
+        assert older["records"][0]["id"] < page["records"][-1]["id"]
+        queries.append(count)
+    delta, count = get_records(app, user_id, session_id, since=page["cursor"])
+    assert delta["records"] == []
+    queries.append(count)
+
+    # One statement to load the logged-in user, one for the records
+    assert queries == [2] * len(queries)
+
+
+def test_records_skip_null_marked_at(app):
+    from app.models import db, AttendanceRecord
+
+    user_id, session_id = seed_session(app, 3)
+    with app.app_context():
+        db.session.query(AttendanceRecord).filter(AttendanceRecord.id == 1).update({"marked_at": None})
+        db.session.commit()
+
+    page, _ = get_records(app, user_id, session_id)
+    assert [record["id"] for record in page["records"]] == [3, 2]
+    assert page["cursor"]